@@ -16,6 +16,14 @@ CREATE TABLE IF NOT EXISTS prices (
     PRIMARY KEY (token_contract, date)
 );
 
+-- CoinGecko daily price cache keyed by coin id (survives pipeline restarts)
+CREATE TABLE IF NOT EXISTS token_prices_daily (
+    coingecko_id TEXT NOT NULL,
+    date TEXT NOT NULL, -- format dd-mm-YYYY, same as prices
+    usd NUMERIC,
+    PRIMARY KEY (coingecko_id, date)
+);
+
 CREATE TABLE IF NOT EXISTS blocks (
     chain VARCHAR(20) NOT NULL,
     block_number BIGINT NOT NULL,
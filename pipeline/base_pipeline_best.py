@@ -1,18 +1,40 @@
 import os
+import io
+import sys
 import json
+import atexit
+import functools
+import pickle
+import weakref
 from web3 import Web3
 from web3.middleware import ExtraDataToPOAMiddleware
+from eth_utils import to_checksum_address
 from dotenv import load_dotenv
 import requests
-from typing import List, Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Dict, Any, Optional, Iterable, Tuple, TextIO
 from datetime import datetime, timezone
 import time
+import sqlite3
+import threading
+import queue
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
 from decimal import Decimal, getcontext
 
+try:
+    import orjson  # optional: much faster (de)serialization of large RPC batches and receipt payloads
+except ImportError:
+    orjson = None
+
 # Increase decimal precision for big-number math
 getcontext().prec = 50
+# 10**decimals for every common ERC-20 decimals value, so the hot loops never call Decimal.__pow__
+DECIMAL_DIVISORS = {d: Decimal(10) ** d for d in range(0, 37)}
+INT_DIVISORS = {d: 10 ** d for d in range(0, 37)}  # same table as ints, for float USD valuation
 
 # --- SETUP & CONNECTIONS ---
 
@@ -25,11 +47,40 @@ DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
+# TCP keepalives so connections left idle while waiting on the chain head aren't silently dropped by NATs/poolers
+DB_KEEPALIVE_KWARGS = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 3}
 
 if not QUICKNODE_URL:
     raise Exception("QUICKNODE_BASE_URL must be set in the .env file.")
 
-w3 = Web3(Web3.HTTPProvider(QUICKNODE_URL))
+# Concurrency knobs (read here because they also size the HTTP connection pool)
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '4'))  # block batches parsed in parallel
+RPC_FETCH_AHEAD = int(os.getenv('RPC_FETCH_AHEAD', '16'))  # block batches whose logs may be in flight at once
+PRICE_FETCH_CONCURRENCY = int(os.getenv('PRICE_FETCH_CONCURRENCY', '4'))  # parallel CoinGecko requests
+# Fail fast on unreachable hosts, but give large batch/receipt responses time to stream
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+# Fetch threads plus every parse worker's CoinGecko fan-out may hold a connection at once
+HTTP_POOL_SIZE = max(32, RPC_FETCH_AHEAD + PIPELINE_WORKERS * (1 + PRICE_FETCH_CONCURRENCY))
+
+def build_http_session() -> requests.Session:
+    """Keep-alive session with a shared connection pool and backoff on transient/rate-limit statuses."""
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'POST']),  # JSON-RPC reads are safe to replay
+    )
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# One pooled session for every HTTP caller (RPC and CoinGecko)
+SESSION = build_http_session()
+RPC_HEADERS = { 'Content-Type': 'application/json' }
+
+w3 = Web3(Web3.HTTPProvider(QUICKNODE_URL, request_kwargs={'timeout': REQUEST_TIMEOUT}, session=SESSION))  # web3 calls reuse the pooled session too
 w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
 
 if not w3.is_connected():
@@ -39,21 +90,59 @@ print(f"✅ Successfully connected to Base network (Chain ID: {w3.eth.chain_id})
 
 # --- CONSTANTS & CACHES ---
 
-TRANSFER_EVENT_TOPIC = w3.keccak(text="Transfer(address,address,uint256)").to_0x_hex()
-ERC20_ABI = json.loads('[{"constant":true,"inputs":[],"name":"name","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[],"name":"symbol","outputs":[{"name":"","type":"string"}],"payable":false,"stateMutability":"view","type":"function"},{"constant":true,"inputs":[],"name":"decimals","outputs":[{"name":"","type":"uint8"}],"payable":false,"stateMutability":"view","type":"function"}]')
+TRANSFER_EVENT_TOPIC = w3.keccak(text="Transfer(address,address,uint256)")  # raw 32 bytes
+TRANSFER_EVENT_TOPIC_HEX = TRANSFER_EVENT_TOPIC.to_0x_hex()  # as it appears in RPC JSON
+# ERC-20 metadata getters: 4-byte selector and ABI return type
+ERC20_METADATA_CALLS = {
+    'name': ('0x06fdde03', 'string'),
+    'symbol': ('0x95d89b41', 'string'),
+    'decimals': ('0x313ce567', 'uint8'),
+}
+# Pool getters: token0()/token1() (Uniswap V2/V3) and tokens() (Solidly/Aerodrome)
+POOL_TOKEN0_SELECTOR = '0x0dfe1681'
+POOL_TOKEN1_SELECTOR = '0xd21220a7'
+POOL_TOKENS_SELECTOR = '0x9d63848a'
+METADATA_BATCH_SIZE = 50  # tokens per Multicall3 aggregate (3 sub-calls each)
+POOL_BATCH_SIZE = 100  # pools per Multicall3 aggregate (2 sub-calls each)
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"  # same address on Base
+MULTICALL3_AGGREGATE3_SELECTOR = "0x82ad56cb"  # aggregate3((address,bool,bytes)[])
 COINGECKO_ASSET_PLATFORM_ID = "base"
 CHAIN = "base"
 CONFIRMATIONS = 5  # avoid reorgs
-REQUEST_TIMEOUT = 20  # seconds
+INSERT_PAGE_SIZE = 1000  # rows per multi-row INSERT statement
+BLOCK_BATCH_SIZE = int(os.getenv('BLOCK_BATCH_SIZE', '25'))  # blocks per JSON-RPC batch during catch-up
+DB_COMMIT_BLOCKS = int(os.getenv('DB_COMMIT_BLOCKS', '25'))  # blocks written per DB transaction
+DB_QUEUE_DEPTH = int(os.getenv('DB_QUEUE_DEPTH', '4'))  # parsed batches buffered ahead of the db-writer thread
+RPC_BATCH_ATTEMPTS = 3  # tries for a receipts batch (on top of the adapter's HTTP retries) before the run stops
+RPC_RETRY_BACKOFF = 2  # seconds, times the attempt number, between receipts batch tries
+VERBOSE = os.getenv('PIPELINE_VERBOSE', '0') == '1'  # per-block/per-request detail; warnings and errors always print
+PROGRESS_EVERY_BLOCKS = int(os.getenv('PROGRESS_EVERY_BLOCKS', '100'))  # blocks between progress lines
+PRICE_CACHE_SQLITE_PATH = os.getenv('PRICE_CACHE_SQLITE_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), "price_cache.sqlite"))
+PRICE_NEGATIVE_CACHE_TTL = 24 * 3600  # seconds before a "CoinGecko has no USD price" answer is asked again
+METADATA_NEGATIVE_CACHE_TTL = 7 * 24 * 3600  # seconds before a contract that failed metadata calls is re-checked
+METADATA_RETRY_SECONDS = 60  # seconds before tokens whose metadata multicall failed in transport are requested again
+COINGECKO_CALLS_PER_MINUTE = int(os.getenv('COINGECKO_CALLS_PER_MINUTE', '45'))  # free tier allowance
 COIN_LIST_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "coin_list.json")
+COIN_MAP_CACHE_PATH = os.path.join(os.path.dirname(COIN_LIST_CACHE_PATH), "coin_list.map.pkl")  # derived address -> id map
+COIN_MAP_CACHE_VERSION = 2  # bump when the map's key format changes (2: lowercase keys)
 UNIV2_SWAP_TOPIC = w3.keccak(text="Swap(address,uint256,uint256,uint256,uint256,address)").to_0x_hex()
 UNIV2_SWAP_TOPIC_ALT = w3.keccak(text="Swap(address,address,uint256,uint256,uint256,uint256)").to_0x_hex()
 UNIV3_SWAP_TOPIC = w3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)").to_0x_hex()
+SWAP_TOPICS = (UNIV2_SWAP_TOPIC, UNIV2_SWAP_TOPIC_ALT, UNIV3_SWAP_TOPIC)
+SWAP_TOPICS_BYTES = [bytes.fromhex(t[2:]) for t in SWAP_TOPICS]  # for logsBloom checks
+# topic0 (lowercase hex, as RPC JSON returns it) -> log bucket; one hash lookup per log replaces topic comparisons
+LOG_TOPIC_BUCKETS = {
+    TRANSFER_EVENT_TOPIC_HEX: 'transfer',
+    UNIV2_SWAP_TOPIC: 'v2',
+    UNIV2_SWAP_TOPIC_ALT: 'v2',
+    UNIV3_SWAP_TOPIC: 'v3',
+}
 
 # Output sink configuration
-PIPELINE_SINK = os.getenv('PIPELINE_SINK', 'db').lower()  # db | csv | both
+PIPELINE_SINK = os.getenv('PIPELINE_SINK', 'db').lower()  # db | csv | both | parquet (comma-combinable)
 USE_DB = 'db' in PIPELINE_SINK
 USE_CSV = 'csv' in PIPELINE_SINK or PIPELINE_SINK == 'both'
+USE_PARQUET = 'parquet' in PIPELINE_SINK
 OUTPUT_DIR = os.getenv('OUTPUT_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'output'))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -61,6 +150,9 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 PRICE_MODE = os.getenv('PRICE_MODE', 'inline').lower()  # inline | deferred
 DEFER_PRICES = PRICE_MODE == 'deferred'
 
+# USD value columns (floats on the records) in CSV and DB naming; text sinks write them via usd_numeric_text
+USD_COLUMNS = {'usdValue', 'usdValueIn', 'usdValueOut', 'usd_value', 'usd_value_in', 'usd_value_out'}
+
 # CSV column orders matching DB schema
 CSV_COLUMNS_TRANSFERS = [
     'blockNumber','timestamp','chain','transactionHash','logIndex',
@@ -72,6 +164,31 @@ CSV_COLUMNS_SWAPS = [
     'tokenOutContract','tokenOutSymbol','amountOut','usdValueOut'
 ]
 
+# Parsed rows are namedtuples in CSV column order, so every sink consumes them positionally
+TransferRecord = namedtuple('TransferRecord', CSV_COLUMNS_TRANSFERS)
+SwapRecord = namedtuple('SwapRecord', CSV_COLUMNS_SWAPS)
+
+# DB column orders for COPY (listed in the CSV/record order, so records are COPY rows as-is)
+DB_COLUMNS_TRANSFERS = [
+    'block_number','timestamp','chain','transaction_hash','log_index',
+    'token_contract','token_symbol','from_address','to_address','value','usd_value'
+]
+DB_COLUMNS_SWAPS = [
+    'block_number','timestamp','chain','transaction_hash','log_index','pool_contract',
+    'token_in_contract','token_in_symbol','amount_in','usd_value_in',
+    'token_out_contract','token_out_symbol','amount_out','usd_value_out'
+]
+
+# Parquet column types (Decimals are kept as exact strings); repeated addresses are dictionary-encoded
+PARQUET_COLUMN_TYPES = {
+    'blockNumber': 'int64', 'timestamp': 'int64', 'logIndex': 'int32',
+    'tokenContract': 'dictionary', 'fromAddress': 'dictionary', 'toAddress': 'dictionary',
+    'poolContract': 'dictionary', 'tokenInContract': 'dictionary', 'tokenOutContract': 'dictionary',
+    # USD values are floats already; raw amounts stay strings since uint256 overflows even decimal256
+    'usdValue': 'float64', 'usdValueIn': 'float64', 'usdValueOut': 'float64',
+}
+PARQUET_BLOCKS_PER_PARTITION = 10000
+
 # CSV schemas for registry/queue
 CSV_COLUMNS_TOKENS = [
     'tokenContract','symbol','decimals','firstSeenBlock','firstSeenAt'
@@ -83,9 +200,56 @@ CSV_COLUMNS_PRICE_TASKS = [
 # Caches to minimize external API calls
 TOKEN_METADATA_CACHE: Dict[str, Optional[Dict[str, Any]]] = {}
 PRICE_CACHE: Dict[str, Optional[float]] = {}
-ADDRESS_TO_ID_MAP: Dict[str, str] = {}
+ADDRESS_TO_ID_MAP: Dict[str, str] = {}  # lowercase Base contract address -> CoinGecko id
 POOL_TOKEN_CACHE: Dict[str, Optional[Dict[str, str]]] = {}
+# Lowercase addresses cached as None above; their logs are dropped before any decoding
+UNRESOLVED_TOKENS: set = set()
+UNRESOLVED_POOLS: set = set()
+# Tokens whose metadata multicall failed in transport (not cached above) -> time.monotonic() of the failure
+METADATA_UNAVAILABLE: Dict[str, float] = {}
+PREPARED_STATEMENTS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()  # connection -> names PREPAREd on it
 PRICE_TASKS_SET = set()  # in-memory dedupe per run
+PRICE_TASKS_LOCK = threading.Lock()
+PRICE_DB_CONN = None  # lazily opened autocommit connection backing PRICE_CACHE (False if unavailable)
+PRICE_DB_LOCK = threading.Lock()
+PRICE_SQLITE_CONN = None  # lazily opened local price/metadata cache, shared across threads (False if unavailable)
+PRICE_SQLITE_LOCK = threading.Lock()
+CSV_WRITE_LOCK = threading.Lock()  # parser threads share tokens.csv / price_tasks.csv
+_CSV_WRITERS: Dict[str, Tuple[TextIO, Any]] = {}  # path -> (open handle, DictWriter) kept for the run
+_CSV_BUFFERS: Dict[str, list] = {}  # path -> serialized rows not yet handed to the writer
+_CSV_MAX_BUFFER = 4096
+
+class RateLimiter:
+    """Thread-safe token bucket: bursts up to `calls` requests, refilled evenly over `period` seconds."""
+
+    def __init__(self, calls: int, period: float):
+        self.capacity = float(max(1, calls))
+        self.tokens = self.capacity
+        self.fill_rate = self.capacity / period
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+COINGECKO_RATE_LIMITER = RateLimiter(COINGECKO_CALLS_PER_MINUTE, 60)
+
+def json_loads(content: bytes) -> Any:
+    """Parse a JSON response body, using orjson when available."""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+def json_dumps(obj: Any) -> bytes:
+    """Serialize a JSON request body to bytes, using orjson when available."""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
 
 # --- DATABASE CONNECTION ---
 def get_db_connection():
@@ -96,7 +260,8 @@ def get_db_connection():
             port=DB_PORT,
             dbname=DB_NAME,
             user=DB_USER,
-            password=DB_PASS
+            password=DB_PASS,
+            **DB_KEEPALIVE_KWARGS
         )
         print("✅ Successfully connected to PostgreSQL database.")
         return conn
@@ -104,94 +269,310 @@ def get_db_connection():
         print(f"❌ Could not connect to the database: {e}")
         return None
 
-def insert_transfers(conn, block_number: int, transfers: List[Dict[str, Any]]):
-    """Write transfers to DB and/or CSV according to PIPELINE_SINK."""
+def get_price_db_connection():
+    """Lazily open a separate autocommit connection for the token_prices_daily cache."""
+    global PRICE_DB_CONN
+    if not USE_DB or PRICE_DB_CONN is False:
+        return None
+    if PRICE_DB_CONN is None or PRICE_DB_CONN.closed:
+        try:
+            PRICE_DB_CONN = psycopg2.connect(
+                host=DB_HOST,
+                port=DB_PORT,
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASS,
+                **DB_KEEPALIVE_KWARGS
+            )
+            PRICE_DB_CONN.autocommit = True
+        except psycopg2.OperationalError as e:
+            print(f"⚠️ Price cache DB unavailable, using in-process cache only: {e}")
+            PRICE_DB_CONN = False
+            return None
+    return PRICE_DB_CONN
+
+def get_price_sqlite_connection():
+    """Lazily open the local SQLite cache of prices and token metadata (works for every sink, no server needed)."""
+    global PRICE_SQLITE_CONN
+    if PRICE_SQLITE_CONN is False:
+        return None
+    if PRICE_SQLITE_CONN is None:
+        try:
+            conn = sqlite3.connect(PRICE_CACHE_SQLITE_PATH, check_same_thread=False)
+            # WAL + NORMAL: one fsync per checkpoint rather than per committed batch
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prices ("
+                "coingecko_id TEXT NOT NULL, date TEXT NOT NULL, price REAL, fetched_at INTEGER NOT NULL, "
+                "PRIMARY KEY (coingecko_id, date))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_metadata ("
+                "address TEXT PRIMARY KEY, name TEXT, symbol TEXT, decimals INTEGER, fetched_at INTEGER NOT NULL)"
+            )
+            conn.commit()
+            PRICE_SQLITE_CONN = conn
+        except sqlite3.Error as e:
+            print(f"⚠️ Local price cache unavailable: {e}")
+            PRICE_SQLITE_CONN = False
+            return None
+    return PRICE_SQLITE_CONN
+
+def load_local_prices(pairs: List[Tuple[str, str]]) -> None:
+    """Warm PRICE_CACHE from the SQLite cache; NULL rows (no CoinGecko price) count as hits until they expire."""
+    now = time.time()
+    try:
+        with PRICE_SQLITE_LOCK:
+            conn = get_price_sqlite_connection()
+            if not conn:
+                return
+            for coingecko_id, date_str in pairs:
+                row = conn.execute(
+                    "SELECT price, fetched_at FROM prices WHERE coingecko_id = ? AND date = ?", (coingecko_id, date_str)
+                ).fetchone()
+                if row is None or (row[0] is None and now - row[1] > PRICE_NEGATIVE_CACHE_TTL):
+                    continue
+                PRICE_CACHE[f"{coingecko_id}-{date_str}"] = row[0]
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not read local price cache: {e}")
+
+def store_local_prices(rows: List[Tuple[str, str, Optional[float]]]) -> None:
+    """Record answered lookups (including None for tokens without a USD price) in the SQLite cache."""
+    if not rows:
+        return
+    now = int(time.time())
+    try:
+        with PRICE_SQLITE_LOCK:
+            conn = get_price_sqlite_connection()
+            if not conn:
+                return
+            conn.executemany(
+                "INSERT OR REPLACE INTO prices (coingecko_id, date, price, fetched_at) VALUES (?, ?, ?, ?)",
+                [(coingecko_id, date_str, price, now) for coingecko_id, date_str, price in rows]
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not write local price cache: {e}")
+
+def load_local_metadata(addresses: List[str]) -> None:
+    """Warm TOKEN_METADATA_CACHE from the SQLite cache; non-ERC-20 contracts (NULL decimals) count as hits until they expire."""
+    if not addresses:
+        return
+    now = time.time()
+    try:
+        with PRICE_SQLITE_LOCK:
+            conn = get_price_sqlite_connection()
+            if not conn:
+                return
+            for i in range(0, len(addresses), 500):  # stay under SQLite's bound-parameter limit
+                chunk = addresses[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT address, name, symbol, decimals, fetched_at FROM token_metadata WHERE address IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for address, name, symbol, decimals, fetched_at in rows:
+                    if decimals is None:
+                        if now - fetched_at <= METADATA_NEGATIVE_CACHE_TTL:
+                            TOKEN_METADATA_CACHE[address] = None
+                            UNRESOLVED_TOKENS.add(address.lower())
+                        continue
+                    TOKEN_METADATA_CACHE[address] = {'name': name, 'symbol': symbol, 'decimals': decimals}
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not read local metadata cache: {e}")
+
+def store_local_metadata(addresses: List[str]) -> None:
+    """Persist freshly resolved TOKEN_METADATA_CACHE entries (None as NULL fields) in one transaction."""
+    rows = []
+    now = int(time.time())
+    for address in addresses:
+        if address not in TOKEN_METADATA_CACHE:
+            continue
+        metadata = TOKEN_METADATA_CACHE[address] or {}
+        rows.append((address, metadata.get('name'), metadata.get('symbol'), metadata.get('decimals'), now))
+    if not rows:
+        return
+    try:
+        with PRICE_SQLITE_LOCK:
+            conn = get_price_sqlite_connection()
+            if not conn:
+                return
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_metadata (address, name, symbol, decimals, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not write local metadata cache: {e}")
+
+def load_stored_prices(pairs: List[Tuple[str, str]]) -> None:
+    """Warm PRICE_CACHE from token_prices_daily for the given (coingecko_id, date) pairs in one query."""
+    if not pairs:
+        return
+    wanted = {f"{coingecko_id}-{date_str}" for coingecko_id, date_str in pairs}
+    try:
+        with PRICE_DB_LOCK:
+            conn = get_price_db_connection()
+            if not conn:
+                return
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT coingecko_id, date, usd FROM token_prices_daily WHERE coingecko_id = ANY(%s) AND date = ANY(%s)",
+                    (list({p[0] for p in pairs}), list({p[1] for p in pairs}))
+                )
+                rows = cur.fetchall()
+    except Exception as e:
+        print(f"⚠️ Could not read stored prices: {e}")
+        return
+    for coingecko_id, date_str, usd in rows:
+        cache_key = f"{coingecko_id}-{date_str}"
+        if cache_key in wanted:
+            PRICE_CACHE[cache_key] = float(usd) if usd is not None else None
+
+def store_prices(pairs: List[Tuple[str, str]]) -> None:
+    """Persist freshly fetched prices from PRICE_CACHE to token_prices_daily (failed lookups are not stored)."""
+    rows = [
+        (coingecko_id, date_str, Decimal(str(PRICE_CACHE[f"{coingecko_id}-{date_str}"])))
+        for coingecko_id, date_str in pairs
+        if PRICE_CACHE.get(f"{coingecko_id}-{date_str}") is not None
+    ]
+    if not rows:
+        return
+    try:
+        with PRICE_DB_LOCK:
+            conn = get_price_db_connection()
+            if not conn:
+                return
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO token_prices_daily (coingecko_id, date, usd) VALUES %s ON CONFLICT (coingecko_id, date) DO NOTHING",
+                    rows,
+                    page_size=INSERT_PAGE_SIZE
+                )
+    except Exception as e:
+        print(f"⚠️ Could not store prices: {e}")
+
+def write_transfer_files(block_number: int, transfers: List[TransferRecord]):
+    """Write transfers to the CSV and/or Parquet sinks according to PIPELINE_SINK."""
     if not transfers:
         return
     # CSV
     if USE_CSV:
         transfers_csv_path = os.path.join(OUTPUT_DIR, f'token_transfers_{block_number}.csv')
-        write_csv(transfers_csv_path, transfers, CSV_COLUMNS_TRANSFERS)
-        print(f"📝 Wrote {len(transfers)} transfer records to {transfers_csv_path}.")
-    # DB
-    if USE_DB and conn:
-        query = """
-            INSERT INTO token_transfers (
-                transaction_hash, log_index, block_number, timestamp, chain,
-                token_contract, token_symbol, from_address, to_address, value, usd_value
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (transaction_hash, log_index) DO NOTHING;
-        """
-        data_to_insert = []
-        for t in transfers:
-            data_to_insert.append(
-                (
-                    t['transactionHash'],
-                    int(t['logIndex']),
-                    int(t['blockNumber']),
-                    int(t['timestamp']),
-                    t.get('chain', CHAIN),
-                    t['tokenContract'],
-                    t.get('tokenSymbol'),
-                    t['fromAddress'],
-                    t['toAddress'],
-                    Decimal(str(t.get('value'))) if t.get('value') is not None else None,
-                    Decimal(str(t.get('usdValue'))) if t.get('usdValue') is not None else None,
-                )
+        write_csv(transfers_csv_path, transfers, CSV_COLUMNS_TRANSFERS, keep_open=False)
+        if VERBOSE:
+            print(f"📝 Wrote {len(transfers)} transfer records to {transfers_csv_path}.")
+    # Parquet
+    if USE_PARQUET:
+        transfers_parquet_path = parquet_partition_path('token_transfers', block_number)
+        write_parquet(transfers_parquet_path, transfers, CSV_COLUMNS_TRANSFERS)
+        if VERBOSE:
+            print(f"📝 Wrote {len(transfers)} transfer records to {transfers_parquet_path}.")
+
+def usd_numeric_text(usd: Optional[float]) -> Optional[str]:
+    """A USD value as plain NUMERIC text (never E-notation), the same form price_worker writes."""
+    return format(Decimal(str(usd)), 'f') if usd is not None else None
+
+def _usd_as_text(rows: list, columns: List[str]) -> list:
+    """Rows with their USD columns rendered by usd_numeric_text (str() of a float would give e.g. 1e-05)."""
+    usd_indexes = [i for i, c in enumerate(columns) if c in USD_COLUMNS]
+    if not usd_indexes:
+        return rows
+    out = []
+    for row in rows:
+        if any(row[i] is not None for i in usd_indexes):
+            row = list(row)
+            for i in usd_indexes:
+                row[i] = usd_numeric_text(row[i])
+        out.append(row)
+    return out
+
+def _copy_text_field(v) -> str:
+    """Format one value for COPY ... FROM STDIN text format (NULL as \\N, escapes for tab/newline/backslash)."""
+    if v is None:
+        return '\\N'
+    return str(v).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_insert(conn, table: str, columns: List[str], rows: Iterable[tuple]) -> None:
+    """COPY rows into a temp staging copy of `table`, then move them over with ON CONFLICT (transaction_hash, log_index) DO NOTHING."""
+    stage = f"{table}_stage"
+    column_list = ', '.join(columns)
+    buffer = io.StringIO()
+    for row in _usd_as_text(list(rows), columns):
+        buffer.write('\t'.join(_copy_text_field(v) for v in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    with conn.cursor() as cursor:
+        # COPY streams every row in one message; the staging table lets ON CONFLICT still apply
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(f"COPY {stage} ({column_list}) FROM STDIN", buffer)
+        # The stage -> table move is the same statement every group: parse/plan it once per connection
+        statement = f"move_{stage}"
+        prepared = PREPARED_STATEMENTS.setdefault(conn, set())
+        if statement not in prepared:
+            cursor.execute(
+                f"PREPARE {statement} AS INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {stage} "
+                "ON CONFLICT (transaction_hash, log_index) DO NOTHING"
             )
-        with conn.cursor() as cursor:
-            execute_batch(cursor, query, data_to_insert)
-        conn.commit()
-        print(f"✅ Inserted {len(data_to_insert)} records into token_transfers.")
+            prepared.add(statement)  # session-level: survives a rolled-back transaction
+        cursor.execute(f"EXECUTE {statement}")
+        cursor.execute(f"TRUNCATE {stage}")
+
+def insert_transfers(conn, transfers: List[TransferRecord]):
+    """Insert transfers into token_transfers via COPY; the caller owns the transaction."""
+    if not transfers or not conn:
+        return
+    copy_insert(conn, 'token_transfers', DB_COLUMNS_TRANSFERS, transfers)
+    if VERBOSE:
+        print(f"✅ Inserted {len(transfers)} records into token_transfers.")
 
-def insert_swaps(conn, block_number: int, swaps: List[Dict[str, Any]]):
-    """Write swaps to DB and/or CSV according to PIPELINE_SINK."""
+def write_swap_files(block_number: int, swaps: List[SwapRecord]):
+    """Write swaps to the CSV and/or Parquet sinks according to PIPELINE_SINK."""
     if not swaps:
         return
     # CSV
     if USE_CSV:
         swaps_csv_path = os.path.join(OUTPUT_DIR, f'dex_swaps_{block_number}.csv')
-        write_csv(swaps_csv_path, swaps, CSV_COLUMNS_SWAPS)
-        print(f"📝 Wrote {len(swaps)} swap records to {swaps_csv_path}.")
-    # DB
-    if USE_DB and conn:
-        query = """
-            INSERT INTO dex_swaps (
-                transaction_hash, log_index, block_number, timestamp, chain,
-                pool_contract, token_in_contract, token_in_symbol, amount_in, usd_value_in,
-                token_out_contract, token_out_symbol, amount_out, usd_value_out
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (transaction_hash, log_index) DO NOTHING;
-        """
-        data_to_insert = []
-        for s in swaps:
-            data_to_insert.append(
-                (
-                    s['transactionHash'],
-                    int(s['logIndex']),
-                    int(s['blockNumber']),
-                    int(s['timestamp']),
-                    s.get('chain', CHAIN),
-                    s['poolContract'],
-                    s['tokenInContract'],
-                    s.get('tokenInSymbol'),
-                    Decimal(str(s.get('amountIn'))) if s.get('amountIn') is not None else None,
-                    Decimal(str(s.get('usdValueIn'))) if s.get('usdValueIn') is not None else None,
-                    s['tokenOutContract'],
-                    s.get('tokenOutSymbol'),
-                    Decimal(str(s.get('amountOut'))) if s.get('amountOut') is not None else None,
-                    Decimal(str(s.get('usdValueOut'))) if s.get('usdValueOut') is not None else None,
-                )
-            )
-        with conn.cursor() as cursor:
-            execute_batch(cursor, query, data_to_insert)
-        conn.commit()
-        print(f"✅ Inserted {len(data_to_insert)} records into dex_swaps.")
+        write_csv(swaps_csv_path, swaps, CSV_COLUMNS_SWAPS, keep_open=False)
+        if VERBOSE:
+            print(f"📝 Wrote {len(swaps)} swap records to {swaps_csv_path}.")
+    # Parquet
+    if USE_PARQUET:
+        swaps_parquet_path = parquet_partition_path('dex_swaps', block_number)
+        write_parquet(swaps_parquet_path, swaps, CSV_COLUMNS_SWAPS)
+        if VERBOSE:
+            print(f"📝 Wrote {len(swaps)} swap records to {swaps_parquet_path}.")
+
+def insert_swaps(conn, swaps: List[SwapRecord]):
+    """Insert swaps into dex_swaps via COPY; the caller owns the transaction."""
+    if not swaps or not conn:
+        return
+    copy_insert(conn, 'dex_swaps', DB_COLUMNS_SWAPS, swaps)
+    if VERBOSE:
+        print(f"✅ Inserted {len(swaps)} records into dex_swaps.")
 
 # --- DATA LOADING & MAPPING ---
 
+def load_address_map_cache(source_mtime: float) -> Optional[Dict[str, str]]:
+    """Return the derived address map saved for this exact coin_list.json (by mtime), if any."""
+    try:
+        with open(COIN_MAP_CACHE_PATH, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('source_mtime') == source_mtime and cached.get('version') == COIN_MAP_CACHE_VERSION:
+            return cached['map']
+    except Exception:
+        pass
+    return None
+
+def save_address_map_cache(source_mtime: float) -> None:
+    """Persist ADDRESS_TO_ID_MAP next to coin_list.json (pickled, the fastest thing to load) so later runs skip the full list."""
+    try:
+        with open(COIN_MAP_CACHE_PATH, 'wb') as f:
+            pickle.dump({'source_mtime': source_mtime, 'version': COIN_MAP_CACHE_VERSION, 'map': ADDRESS_TO_ID_MAP}, f, protocol=5)
+    except Exception:
+        pass
+
 def build_address_to_id_map():
     """
     Fetches the master token list from CoinGecko and builds a direct
@@ -201,168 +582,539 @@ def build_address_to_id_map():
     try:
         print("\nBuilding address-to-id map from CoinGecko (with local cache)...")
         token_list = None
+        list_mtime = None
         # Use local cache if exists and is fresh (< 24h)
         try:
             if os.path.exists(COIN_LIST_CACHE_PATH):
                 mtime = os.path.getmtime(COIN_LIST_CACHE_PATH)
                 if time.time() - mtime < 24 * 3600:
-                    with open(COIN_LIST_CACHE_PATH, 'r') as f:
-                        token_list = json.load(f)
+                    cached_map = load_address_map_cache(mtime)
+                    if cached_map is not None:
+                        ADDRESS_TO_ID_MAP.update(cached_map)
+                        print(f"✅ Map loaded from cache. Found {len(ADDRESS_TO_ID_MAP)} tokens on {COINGECKO_ASSET_PLATFORM_ID}.")
+                        return
+                    with open(COIN_LIST_CACHE_PATH, 'rb') as f:
+                        token_list = json_loads(f.read())
+                    list_mtime = mtime
         except Exception:
             token_list = None
         if token_list is None:
             url = "https://api.coingecko.com/api/v3/coins/list?include_platform=true"
-            response = requests.get(url, timeout=REQUEST_TIMEOUT)
+            response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            token_list = response.json()
-            # write cache best-effort
+            token_list = json_loads(response.content)
+            # write cache best-effort (the body as received; re-encoding it would only cost CPU)
             try:
-                with open(COIN_LIST_CACHE_PATH, 'w') as f:
-                    json.dump(token_list, f)
+                with open(COIN_LIST_CACHE_PATH, 'wb') as f:
+                    f.write(response.content)
+                list_mtime = os.path.getmtime(COIN_LIST_CACHE_PATH)
             except Exception:
                 pass
         for token in token_list:
             platforms = token.get('platforms', {})
             base_address = platforms.get(COINGECKO_ASSET_PLATFORM_ID)
             if base_address:
-                try:
-                    checksum_address = Web3.to_checksum_address(base_address)
-                    ADDRESS_TO_ID_MAP[checksum_address] = token['id']
-                except Exception:
-                    continue
+                # Keyed by lowercase hex, so neither building nor lookups need a keccak checksum
+                address = base_address.strip().lower()
+                if len(address) == 42 and address.startswith('0x'):
+                    ADDRESS_TO_ID_MAP[address] = token['id']
+        if list_mtime is not None:
+            save_address_map_cache(list_mtime)
         print(f"✅ Map built successfully. Found {len(ADDRESS_TO_ID_MAP)} tokens on {COINGECKO_ASSET_PLATFORM_ID}.")
     except Exception as e:
         print(f"⚠️ Warning: Could not build CoinGecko address map. Price enrichment may fail. Error: {e}")
 
 # --- CORE DATA FETCHING LOGIC ---
 
-def get_block_with_receipts(block_number: int) -> Optional[Dict[str, Any]]:
-    """Fetches block data and all its transaction receipts."""
-    print(f"\nAttempting to fetch block and receipts for: {block_number}...")
+def post_rpc_batch(calls: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """POST a JSON-RPC batch array in one round trip and return responses keyed by id."""
+    if not calls:
+        return {}
+    payload = json_dumps(calls)
+    # Transient errors are retried with backoff by the session adapter
+    response = SESSION.post(QUICKNODE_URL, headers=RPC_HEADERS, data=payload, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = json_loads(response.content)
+    if isinstance(data, dict):
+        # Some providers answer a rejected batch with a single error object
+        raise Exception(f"RPC batch rejected: {data.get('error', data)}")
+    return {item.get('id'): item for item in data}
+
+def encode_aggregate3_calls(calls: List[Tuple[str, str]]) -> str:
+    """ABI-encode [(target, calldata)] as aggregate3's (address,bool,bytes)[] argument (allowFailure=true), as hex."""
+    heads = []
+    tails = []
+    offset = 32 * len(calls)  # tuple offsets are relative to the end of the length word
+    for target, calldata in calls:
+        data = calldata[2:]
+        padded = data + '0' * (-len(data) % 64)
+        heads.append('%064x' % offset)
+        # address, allowFailure, offset of bytes within the tuple (3 head words), bytes length, bytes
+        tails.append(target[2:].lower().rjust(64, '0') + '%064x' % 1 + '%064x' % 96 + '%064x' % (len(data) // 2) + padded)
+        offset += 128 + len(padded) // 2
+    return '%064x' % 32 + '%064x' % len(calls) + ''.join(heads) + ''.join(tails)
+
+def decode_aggregate3_result(data: bytes) -> List[Tuple[bool, bytes]]:
+    """Decode aggregate3's (bool,bytes)[] return value into (success, returnData) pairs."""
+    start = int.from_bytes(data[:32], 'big')
+    count = int.from_bytes(data[start:start + 32], 'big')
+    base = start + 32  # tuple offsets are relative to here
+    if base + 32 * count > len(data):
+        raise ValueError('aggregate3 result shorter than its length')
+    out = []
+    for i in range(count):
+        tuple_start = base + int.from_bytes(data[base + 32 * i:base + 32 * i + 32], 'big')
+        success = int.from_bytes(data[tuple_start:tuple_start + 32], 'big')
+        data_start = tuple_start + int.from_bytes(data[tuple_start + 32:tuple_start + 64], 'big')
+        length = int.from_bytes(data[data_start:data_start + 32], 'big')
+        if success > 1 or data_start + 32 + length > len(data):
+            raise ValueError('malformed aggregate3 result')
+        out.append((bool(success), data[data_start + 32:data_start + 32 + length]))
+    return out
+
+def multicall_request(req_id: int, calls: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """Build one eth_call entry that runs [(target, calldata)] through Multicall3.aggregate3 (failures allowed)."""
+    return {
+        "jsonrpc": "2.0",
+        "id": req_id,
+        "method": "eth_call",
+        "params": [{"to": MULTICALL3_ADDRESS, "data": MULTICALL3_AGGREGATE3_SELECTOR + encode_aggregate3_calls(calls)}, "latest"]
+    }
+
+def decode_multicall_response(item: Optional[Dict[str, Any]]) -> List[Tuple[bool, bytes]]:
+    """Decode an aggregate3 response into (success, returnData) pairs; empty if the call itself failed."""
+    result = (item or {}).get('result')
+    if not result or result == '0x':
+        return []
+    return decode_aggregate3_result(bytes.fromhex(result[2:]))
+
+def parse_block_header(header: Optional[Dict[str, Any]]) -> Optional[Tuple[int, Optional[bytes]]]:
+    """Timestamp and logsBloom from a batched eth_getBlockByNumber header; None when the header is missing or has no timestamp."""
     try:
-        payload = json.dumps({
-            "method": "eth_getBlockReceipts",
-            "params": [
-                hex(block_number) # "latest"
-                ],
-            "id": 1,
-            "jsonrpc": "2.0"
-        })
-        headers = { 'Content-Type': 'application/json' }
-        # Simple retry for transient RPC errors
-        attempts = 0
-        while True:
-            attempts += 1
-            try:
-                response = requests.post(QUICKNODE_URL, headers=headers, data=payload, timeout=REQUEST_TIMEOUT)
-                break
-            except requests.RequestException as re:
-                if attempts >= 3:
-                    raise re
-                time.sleep(1.5 * attempts)
-        response.raise_for_status()
-        data = response.json()
-        if "error" in data:
-            print(f"❌ RPC Error: {data['error']['message']}")
-            return None
-        receipts = data.get('result')
-        if receipts is None:
-            print(f"No receipts returned for block {block_number}.")
-            return None
-        # Fetch block timestamp for enrichment
+        ts = int(header['timestamp'], 16)
+    except Exception:
+        return None  # usually a block the node has not indexed yet: the caller re-requests it
+    try:
+        logs_bloom = bytes.fromhex(header['logsBloom'][2:])
+    except Exception:
+        logs_bloom = None
+    return ts, logs_bloom
+
+def get_blocks_with_receipts(block_numbers: List[int]) -> List[Dict[str, Any]]:
+    """Fetches receipts and header timestamps for a range of blocks in one JSON-RPC batch.
+
+    Blocks that come back without receipts or header are re-requested; if any are still missing after
+    RPC_BATCH_ATTEMPTS this raises, since returning a partial batch would let the checkpoint
+    move past blocks that were never parsed.
+    """
+    if not block_numbers:
+        return []
+    if VERBOSE:
+        print(f"\nAttempting to fetch blocks and receipts for: {block_numbers[0]}-{block_numbers[-1]}...")
+    blocks: Dict[int, Dict[str, Any]] = {}
+    remaining = list(block_numbers)
+    for attempt in range(1, RPC_BATCH_ATTEMPTS + 1):
+        calls = []
+        id_map: Dict[int, tuple] = {}
+        for block_number in remaining:
+            for kind, method, params in (
+                ('receipts', 'eth_getBlockReceipts', [hex(block_number)]),
+                ('header', 'eth_getBlockByNumber', [hex(block_number), False]),  # header only, for timestamp
+            ):
+                req_id = len(calls) + 1
+                id_map[req_id] = (block_number, kind)
+                calls.append({"jsonrpc": "2.0", "id": req_id, "method": method, "params": params})
         try:
-            b = w3.eth.get_block(block_number)
-            ts = int(b.timestamp)
-        except Exception:
-            ts = int(time.time())
-        print(f"✅ Found {len(receipts)} receipts for block {block_number}.")
-        return {
+            responses = post_rpc_batch(calls)
+        except Exception as e:
+            print(f"❌ Failed to fetch receipts for blocks {remaining[0]}-{remaining[-1]} (attempt {attempt}/{RPC_BATCH_ATTEMPTS}): {e}")
+            responses = {}
+
+        fetched: Dict[int, Dict[str, Any]] = {n: {} for n in remaining}
+        for req_id, (block_number, kind) in id_map.items():
+            item = responses.get(req_id) or {}
+            if "error" in item:
+                print(f"❌ RPC Error ({kind}, block {block_number}): {item['error'].get('message')}")
+                continue
+            fetched[block_number][kind] = item.get('result')
+
+        for block_number in remaining:
+            receipts = fetched[block_number].get('receipts')
+            if receipts is None:
+                if responses:
+                    print(f"No receipts returned for block {block_number}.")
+                continue
+            header = parse_block_header(fetched[block_number].get('header'))
+            if header is None:
+                if responses:
+                    print(f"No header returned for block {block_number}.")
+                continue
+            ts, logs_bloom = header
+            if VERBOSE:
+                print(f"✅ Found {len(receipts)} receipts for block {block_number}.")
+            blocks[block_number] = {
+                'blockNumber': block_number,
+                'timestamp': ts,
+                'logsBloom': logs_bloom,
+                'receipts': receipts
+            }
+        remaining = [n for n in remaining if n not in blocks]
+        if not remaining:
+            break
+        if attempt < RPC_BATCH_ATTEMPTS:
+            time.sleep(RPC_RETRY_BACKOFF * attempt)
+    if remaining:
+        raise Exception(f"Receipts/headers unavailable for blocks {remaining[0]}-{remaining[-1]} ({len(remaining)} blocks) after {RPC_BATCH_ATTEMPTS} attempts")
+    return [blocks[n] for n in block_numbers]
+
+def get_blocks_with_logs(block_numbers: List[int]) -> List[Dict[str, Any]]:
+    """Fetches only Transfer/Swap logs (node-side topic0 filter) plus header timestamps for a block range in one batch; receipts if getLogs fails.
+
+    A missing or errored header usually means the node has not indexed that block yet, so the
+    range's logs are incomplete too: the whole range is re-requested, and after RPC_BATCH_ATTEMPTS
+    this raises rather than emit blocks the checkpoint would then move past.
+    """
+    if not block_numbers:
+        return []
+    if VERBOSE:
+        print(f"\nAttempting to fetch blocks and logs for: {block_numbers[0]}-{block_numbers[-1]}...")
+    log_filter = {
+        "fromBlock": hex(block_numbers[0]),
+        "toBlock": hex(block_numbers[-1]),
+        "topics": [list(LOG_TOPIC_BUCKETS)],  # OR over topic0
+    }
+    calls = [{"jsonrpc": "2.0", "id": 1, "method": "eth_getLogs", "params": [log_filter]}]
+    id_map: Dict[int, int] = {}
+    for block_number in block_numbers:
+        req_id = len(calls) + 1
+        id_map[req_id] = block_number
+        calls.append({"jsonrpc": "2.0", "id": req_id, "method": "eth_getBlockByNumber", "params": [hex(block_number), False]})
+    for attempt in range(1, RPC_BATCH_ATTEMPTS + 1):
+        try:
+            responses = post_rpc_batch(calls)
+        except Exception as e:
+            print(f"❌ Failed to fetch logs for blocks {block_numbers[0]}-{block_numbers[-1]}: {e}")
+            return get_blocks_with_receipts(block_numbers)
+
+        logs_item = responses.get(1) or {}
+        if "error" in logs_item or logs_item.get('result') is None:
+            # e.g. the provider's result-size/range cap on eth_getLogs: fall back to full receipts, filtered client-side
+            print(f"❌ RPC Error (logs, blocks {block_numbers[0]}-{block_numbers[-1]}): {logs_item.get('error', {}).get('message')}; falling back to receipts")
+            return get_blocks_with_receipts(block_numbers)
+
+        headers: Dict[int, Tuple[int, Optional[bytes]]] = {}
+        for req_id, block_number in id_map.items():
+            item = responses.get(req_id) or {}
+            if "error" in item:
+                print(f"❌ RPC Error (header, block {block_number}): {item['error'].get('message')}")
+                continue
+            header = parse_block_header(item.get('result'))
+            if header is None:
+                print(f"No header returned for block {block_number}.")
+            else:
+                headers[block_number] = header
+        if len(headers) == len(block_numbers):
+            break
+        if attempt < RPC_BATCH_ATTEMPTS:
+            time.sleep(RPC_RETRY_BACKOFF * attempt)
+    else:
+        raise Exception(f"Headers unavailable for blocks {block_numbers[0]}-{block_numbers[-1]} after {RPC_BATCH_ATTEMPTS} attempts")
+
+    logs_by_block: Dict[int, List[Dict[str, Any]]] = {n: [] for n in block_numbers}
+    for log in logs_item['result']:
+        if log.get('removed'):
+            continue
+        block_logs = logs_by_block.get(int(log['blockNumber'], 16))
+        if block_logs is not None:
+            block_logs.append(log)
+
+    blocks = []
+    for block_number in block_numbers:
+        ts, logs_bloom = headers[block_number]
+        logs = logs_by_block[block_number]
+        if VERBOSE:
+            print(f"✅ Found {len(logs)} Transfer/Swap logs for block {block_number}.")
+        blocks.append({
             'blockNumber': block_number,
             'timestamp': ts,
-            'receipts': receipts
-        }
-    except Exception as e:
-        print(f"❌ Failed to fetch receipts for block {block_number}: {e}")
-        return None
+            'logsBloom': logs_bloom,
+            'logs': logs
+        })
+    return blocks
 
 # --- DATA PARSING & ENRICHMENT ---
 
-def parse_and_enrich_transfers(block_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+def bloom_contains(bloom: Optional[bytes], item: bytes) -> bool:
+    """Check a 2048-bit logsBloom for an address/topic (3 x 11-bit indices from keccak); True when no bloom is known."""
+    if not bloom or len(bloom) != 256:
+        return True
+    digest = w3.keccak(item)
+    for i in (0, 2, 4):
+        bit = ((digest[i] << 8) | digest[i + 1]) & 2047
+        if not bloom[255 - bit // 8] & (1 << (bit % 8)):
+            return False
+    return True
+
+@functools.lru_cache(maxsize=1 << 18)
+def _checksum_hex40(address_hex40: str) -> str:
+    """EIP-55 checksum of 40 lowercase hex chars, one keccak per distinct address."""
+    return to_checksum_address('0x' + address_hex40)
+
+def _checksum(address_hex: str) -> str:
+    """Checksum an address or 32-byte topic; both forms share one cache entry keyed on the trailing 40 hex chars."""
+    return _checksum_hex40(address_hex[-40:].lower())
+
+def iter_block_logs(block_data: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    """Yield a block's logs, whether it was fetched as a flat eth_getLogs list or as full receipts."""
+    logs = block_data.get('logs')
+    if logs is not None:
+        return logs
+    return (log for receipt in block_data.get('receipts', []) for log in receipt.get('logs', []))
+
+def bucket_logs(block_data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Partition a block's logs into Transfer / V2 swap / V3 swap buckets in one walk."""
+    buckets = block_data.get('logBuckets')
+    if buckets is not None:
+        return buckets
+    buckets = {name: [] for name in LOG_TOPIC_BUCKETS.values()}
+    by_topic = {topic: buckets[name] for topic, name in LOG_TOPIC_BUCKETS.items()}
+    scanned = 0
+    for log in iter_block_logs(block_data):
+        scanned += 1
+        topics = log.get('topics')
+        bucket = by_topic.get(topics[0]) if topics else None
+        if bucket is not None:
+            bucket.append(log)
+    # Both parsers share the partition, so memoize it on the block
+    block_data['logBuckets'] = buckets
+    block_data['scannedLogs'] = scanned
+    return buckets
+
+def _word(data_hex: str, i: int) -> int:
+    """i-th 32-byte ABI word of 0x-prefixed log data as an unsigned int, sliced straight from the hex string."""
+    return int(data_hex[2 + i * 64:2 + (i + 1) * 64], 16)
+
+def decimal_divisor(decimals: int) -> Decimal:
+    """10**decimals as a Decimal, from the precomputed table when possible."""
+    divisor = DECIMAL_DIVISORS.get(decimals)
+    return divisor if divisor is not None else Decimal(10) ** decimals
+
+
+def format_token_amount(raw: int, decimals: int) -> str:
+    """str(Decimal(raw) / 10**decimals) computed with int/str ops only (same digits, trailing zeros and E-notation)."""
+    digits = str(-raw if raw < 0 else raw)
+    if len(digits) > getcontext().prec:
+        return str(Decimal(raw) / decimal_divisor(decimals))  # rounded like the Decimal path
+    exp = -decimals
+    if raw:
+        # An exact quotient keeps only the trailing zeros needed to stay at exponent <= 0
+        drop = min(len(digits) - len(digits.rstrip('0')), decimals)
+        if drop:
+            digits = digits[:-drop]
+            exp += drop
+    else:
+        exp = 0
+    leftdigits = exp + len(digits)
+    dotplace = leftdigits if (exp <= 0 and leftdigits > -6) else 1
+    if dotplace <= 0:
+        intpart, fracpart = '0', '.' + '0' * -dotplace + digits
+    elif dotplace >= len(digits):
+        intpart, fracpart = digits + '0' * (dotplace - len(digits)), ''
+    else:
+        intpart, fracpart = digits[:dotplace], '.' + digits[dotplace:]
+    exp_str = '' if leftdigits == dotplace else 'E%+d' % (leftdigits - dotplace)
+    return ('-' if raw < 0 else '') + intpart + fracpart + exp_str
+
+class TokenAmount:
+    """Raw on-chain integer amount plus token decimals; only turned into an exact decimal string at the sinks."""
+    __slots__ = ('raw', 'decimals')
+
+    def __init__(self, raw: int, decimals: int):
+        self.raw = raw
+        self.decimals = decimals
+
+    def to_float(self) -> float:
+        # Correctly rounded int / int true division; plenty for USD valuation
+        divisor = INT_DIVISORS.get(self.decimals)
+        return self.raw / (divisor if divisor is not None else 10 ** self.decimals)
+
+    def __str__(self) -> str:
+        return format_token_amount(self.raw, self.decimals)
+
+    def __repr__(self) -> str:
+        return f"TokenAmount({self.raw}, {self.decimals})"
+
+def parse_and_enrich_transfers(block_data: Dict[str, Any]) -> List[TransferRecord]:
     """Parses, enriches with metadata, and adds USD value to transfers."""
-    receipts = block_data.get('receipts', [])
     timestamp = block_data.get('timestamp')
-    date_str = datetime.fromtimestamp(timestamp).strftime('%d-%m-%Y')
-    
-    print(f"\nParsing and enriching {len(receipts)} receipts from {date_str}...")
+    # UTC day, like swaps: CoinGecko's daily prices are keyed by the UTC date
+    date_str = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%d-%m-%Y')
+    # Everything below only touches the block's Transfer bucket
+    transfer_bucket = bucket_logs(block_data)['transfer']
+
+    if VERBOSE:
+        print(f"\nParsing and enriching {len(transfer_bucket)} Transfer logs from {date_str}...")
     enriched_transfers = []
 
-    for receipt in receipts:
-        for log in receipt.get('logs', []):
-            if log.get('topics') and log['topics'][0] == TRANSFER_EVENT_TOPIC and len(log['topics']) > 2:
-                try:
-                    token_contract = Web3.to_checksum_address(log['address'])
-                    metadata = get_token_metadata(token_contract)
-                    if not metadata: continue
-
-                    # Get historical price once per (token, date) or defer
-                    coingecko_id = ADDRESS_TO_ID_MAP.get(token_contract)
-                    if DEFER_PRICES:
-                        enqueue_price_task(token_contract, date_str)
-                        price = None
-                    else:
-                        price = get_historical_price(coingecko_id, date_str) if coingecko_id else None
-
-                    from_address = Web3.to_checksum_address('0x' + log['topics'][1][-40:])
-                    to_address = Web3.to_checksum_address('0x' + log['topics'][2][-40:])
-                    
-                    log_data = log.get('data', '0x')
-                    raw_value = 0 if log_data == '0x' else int(log_data, 16)
-                    actual_value = (Decimal(raw_value) / (Decimal(10) ** Decimal(metadata['decimals'])))
-                    usd_value = (actual_value * Decimal(str(price))) if price is not None else None
-
-                    # Normalize indexes and hashes
-                    log_index_hex = log.get('logIndex')
-                    log_index = int(log_index_hex, 16) if isinstance(log_index_hex, str) and log_index_hex.startswith('0x') else int(log_index_hex)
-                    block_number_hex = receipt.get('blockNumber')
-                    block_number = int(block_number_hex, 16) if isinstance(block_number_hex, str) and block_number_hex.startswith('0x') else int(block_number_hex)
-                    tx_hash = receipt['transactionHash']
-
-                    # Record token in registry for later joins/backfills
-                    try:
-                        upsert_token_registry(token_contract, metadata.get('symbol'), int(metadata.get('decimals', 18)), block_number, int(timestamp))
-                    except Exception:
-                        pass
+    # Bind hot-loop globals to locals
+    checksum = _checksum
+    intern = sys.intern
+    word = _word
+    meta_cache = TOKEN_METADATA_CACHE
+    defer_prices = DEFER_PRICES
+    # Every log in the bucket belongs to this block
+    block_number = int(block_data['blockNumber'])
+    timestamp = int(timestamp)
+
+    # Prefilter in one pass: contracts already known not to be ERC-20s are dropped on the raw address,
+    # and each surviving log's token is checksummed once here rather than again in the loop
+    unresolved = UNRESOLVED_TOKENS
+    transfer_logs = []
+    for log in transfer_bucket:
+        topics = log['topics']
+        address = log['address']
+        if len(topics) <= 2 or address.lower() in unresolved:
+            continue
+        try:
+            transfer_logs.append((log, topics, checksum(address)))
+        except Exception:
+            continue
 
-                    enriched_transfers.append({
-                        "blockNumber": block_number,
-                        "timestamp": int(timestamp),
-                        "chain": CHAIN,
-                        "transactionHash": tx_hash,
-                        "logIndex": log_index,
-                        "tokenContract": token_contract,
-                        "tokenSymbol": metadata['symbol'],
-                        "fromAddress": from_address,
-                        "toAddress": to_address,
-                        "value": actual_value,
-                        "usdValue": usd_value
-                    })
-                except Exception as e:
-                    print(f"⚠️ Could not process a log. Error: {e}")
+    # Pre-pass: resolve metadata for every unseen token in one batched round trip
+    get_token_metadata_batch([t for t in dict.fromkeys(token for _, _, token in transfer_logs) if t not in meta_cache])
+
+    for log, topics, token_contract in transfer_logs:
+        try:
+            # Plain dict read; only tokens the pre-pass could not reach fall back to a fetch
+            metadata = meta_cache[token_contract] if token_contract in meta_cache else get_token_metadata(token_contract)
+            if not metadata: continue
+
+            # USD values are joined in bulk by apply_prices() after parsing, or deferred to the price worker
+            if defer_prices:
+                enqueue_price_task(token_contract, date_str)
+
+            # Indexed addresses are the low 20 bytes of each topic; value is the first data word
+            from_address = checksum(topics[1])
+            to_address = checksum(topics[2])
+            data_hex = log.get('data', '0x')
+            raw_value = word(data_hex, 0) if len(data_hex) > 2 else 0  # empty data (non-standard tokens) is zero
+
+            # Normalize indexes and hashes
+            log_index_hex = log.get('logIndex')
+            log_index = int(log_index_hex, 16) if isinstance(log_index_hex, str) and log_index_hex.startswith('0x') else int(log_index_hex)
+            tx_hash = intern(log['transactionHash'])  # logs of one tx share a single hash string
+
+            # Record token in registry for later joins/backfills
+            try:
+                upsert_token_registry(token_contract, metadata.get('symbol'), int(metadata.get('decimals', 18)), block_number, timestamp)
+            except Exception:
+                pass
 
-    print(f"✅ Fully enriched {len(enriched_transfers)} transfer events.")
+            enriched_transfers.append(TransferRecord(
+                blockNumber=block_number,
+                timestamp=timestamp,
+                chain=CHAIN,
+                transactionHash=tx_hash,
+                logIndex=log_index,
+                tokenContract=token_contract,
+                tokenSymbol=metadata['symbol'],
+                fromAddress=from_address,
+                toAddress=to_address,
+                value=TokenAmount(raw_value, int(metadata['decimals'])),
+                usdValue=None,
+            ))
+        except Exception as e:
+            print(f"⚠️ Could not process a log. Error: {e}")
+
+    if VERBOSE:
+        print(f"✅ Fully enriched {len(enriched_transfers)} transfer events.")
     return enriched_transfers
 
+def decode_abi_uint8(data: bytes) -> int:
+    """uint8 return value (first 32-byte word), rejecting out-of-range values like the ABI codec does."""
+    value = int.from_bytes(data[:32], 'big')
+    if len(data) < 32 or value > 0xff:
+        raise ValueError('not a uint8')
+    return value
+
+def decode_abi_string(data: bytes) -> str:
+    """Dynamic ABI string return value (offset, length, utf-8 bytes); bytes32 symbols/names (e.g. MKR) are accepted too."""
+    if len(data) == 32:
+        return data.rstrip(b'\x00').decode('utf-8')
+    offset = int.from_bytes(data[:32], 'big')
+    start = offset + 32
+    if offset % 32 or start > len(data):
+        raise ValueError('invalid string offset')
+    end = start + int.from_bytes(data[offset:start], 'big')
+    if end > len(data):
+        raise ValueError('string length past end of data')
+    return data[start:end].decode('utf-8')
+
+ABI_RESULT_DECODERS = {'string': decode_abi_string, 'uint8': decode_abi_uint8}
+
 def get_token_metadata(token_address: str) -> Optional[Dict[str, Any]]:
     """Fetches ERC-20 token metadata using a cache."""
     if token_address in TOKEN_METADATA_CACHE: return TOKEN_METADATA_CACHE[token_address]
+    get_token_metadata_batch([token_address])
+    return TOKEN_METADATA_CACHE.get(token_address)
+
+def get_token_metadata_batch(addresses: List[str]) -> None:
+    """Fetch name/symbol/decimals for all uncached tokens via Multicall3, one aggregate per chunk, one POST total."""
+    # Tokens whose last attempt failed in transport sit out METADATA_RETRY_SECONDS, so per-log lookups never refetch them
+    retry_before = time.monotonic() - METADATA_RETRY_SECONDS
+    pending = [
+        a for a in dict.fromkeys(addresses)
+        if a not in TOKEN_METADATA_CACHE and METADATA_UNAVAILABLE.get(a, retry_before) <= retry_before
+    ]
+    if not pending:
+        return
+    # Tokens seen by earlier runs come from the local cache; only the rest go to the chain
+    load_local_metadata(pending)
+    pending = [a for a in pending if a not in TOKEN_METADATA_CACHE]
+    if not pending:
+        return
+    chunks = [pending[i:i + METADATA_BATCH_SIZE] for i in range(0, len(pending), METADATA_BATCH_SIZE)]
+    fields = list(ERC20_METADATA_CALLS.items())
+    requests_batch = [
+        multicall_request(req_id, [(addr, selector) for addr in chunk for _, (selector, _) in fields])
+        for req_id, chunk in enumerate(chunks, start=1)
+    ]
     try:
-        contract = w3.eth.contract(address=token_address, abi=ERC20_ABI)
-        metadata = {"name": contract.functions.name().call(), "symbol": contract.functions.symbol().call(), "decimals": contract.functions.decimals().call()}
-        TOKEN_METADATA_CACHE[token_address] = metadata
-        return metadata
-    except Exception:
-        TOKEN_METADATA_CACHE[token_address] = None
-        return None
+        responses = post_rpc_batch(requests_batch)
+    except Exception as e:
+        print(f"⚠️ Token metadata multicall failed for {len(pending)} tokens: {e}")
+        responses = {}
+
+    for req_id, chunk in enumerate(chunks, start=1):
+        try:
+            results = decode_multicall_response(responses.get(req_id))
+        except Exception:
+            results = []
+        if not results:
+            # The aggregate itself failed (transport/RPC error): leave the chunk uncached, and record the
+            # failure so callers skip these tokens until a later block retries after METADATA_RETRY_SECONDS
+            failed_at = time.monotonic()
+            for addr in chunk:
+                METADATA_UNAVAILABLE[addr] = failed_at
+            continue
+        for i, addr in enumerate(chunk):
+            METADATA_UNAVAILABLE.pop(addr, None)
+            metadata: Optional[Dict[str, Any]] = {}
+            for j, (field, (_, abi_type)) in enumerate(fields):
+                k = i * len(fields) + j
+                success, return_data = results[k] if k < len(results) else (False, b'')
+                try:
+                    if not success or not return_data:
+                        raise ValueError(field)
+                    metadata[field] = ABI_RESULT_DECODERS[abi_type](return_data)
+                except Exception:
+                    # Tokens that revert or return garbage for any field are cached as None
+                    metadata = None
+                    break
+            TOKEN_METADATA_CACHE[addr] = metadata
+            if metadata is None:
+                UNRESOLVED_TOKENS.add(addr.lower())
+    store_local_metadata(pending)
 
 def get_historical_price(coingecko_id: Optional[str], date_str: str) -> Optional[float]:
     """Gets historical price for a given CoinGecko ID on a specific date."""
@@ -371,28 +1123,51 @@ def get_historical_price(coingecko_id: Optional[str], date_str: str) -> Optional
     cache_key = f"{coingecko_id}-{date_str}"
     if cache_key in PRICE_CACHE: return PRICE_CACHE[cache_key]
 
-    try:
+    prefetch_historical_prices([(coingecko_id, date_str)])
+    return PRICE_CACHE.get(cache_key)
+
+def fetch_historical_price(coingecko_id: str, date_str: str) -> Optional[float]:
+    """Fetch one historical price from CoinGecko (None when it has no USD price); raises on request errors."""
+    if VERBOSE:
         print(f"    Fetching price for {coingecko_id} on {date_str}...")
-        url = f"https://api.coingecko.com/api/v3/coins/{coingecko_id}/history?date={date_str}"
-        attempts = 0
-        while True:
-            attempts += 1
-            try:
-                response = requests.get(url, timeout=REQUEST_TIMEOUT)
-                break
-            except requests.RequestException as re:
-                if attempts >= 3:
-                    raise re
-                time.sleep(1.5 * attempts)
-        response.raise_for_status()
-        data = response.json()
-        price = data.get('market_data', {}).get('current_price', {}).get('usd')
-        PRICE_CACHE[cache_key] = price
-        time.sleep(1.2) # Respect CoinGecko's free tier rate limit
-        return price
+    url = f"https://api.coingecko.com/api/v3/coins/{coingecko_id}/history?date={date_str}"
+    COINGECKO_RATE_LIMITER.acquire()  # Respect CoinGecko's free tier rate limit
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = json_loads(response.content)
+    return data.get('market_data', {}).get('current_price', {}).get('usd')
+
+def _fetch_price_pair(pair: Tuple[str, str]) -> Tuple[str, str, Optional[float], bool]:
+    """(coingecko_id, date, price, answered) for one pair; answered is False when the request itself failed."""
+    try:
+        return pair[0], pair[1], fetch_historical_price(*pair), True
     except Exception:
-        PRICE_CACHE[cache_key] = None
-        return None
+        return pair[0], pair[1], None, False
+
+def prefetch_historical_prices(pairs: Iterable[Tuple[Optional[str], str]]) -> None:
+    """Resolve uncached (coingecko_id, date) prices into PRICE_CACHE: local cache, then Postgres, then CoinGecko concurrently."""
+    missing = [
+        (coingecko_id, date_str) for coingecko_id, date_str in dict.fromkeys(pairs)
+        if coingecko_id and f"{coingecko_id}-{date_str}" not in PRICE_CACHE
+    ]
+    for load in (load_local_prices, load_stored_prices):
+        if not missing:
+            return
+        load(missing)
+        missing = [(coingecko_id, date_str) for coingecko_id, date_str in missing if f"{coingecko_id}-{date_str}" not in PRICE_CACHE]
+    if not missing:
+        return
+    if len(missing) == 1:
+        results = [_fetch_price_pair(missing[0])]
+    else:
+        workers = max(1, min(PRICE_FETCH_CONCURRENCY, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_fetch_price_pair, missing))
+    for coingecko_id, date_str, price, _ in results:
+        PRICE_CACHE[f"{coingecko_id}-{date_str}"] = price
+    # Failed requests stay out of the persistent caches so a later run retries them
+    store_local_prices([(coingecko_id, date_str, price) for coingecko_id, date_str, price, answered in results if answered])
+    store_prices(missing)
 
 def upsert_token_registry(token_contract: str, symbol: Optional[str], decimals: Optional[int], block_number: int, timestamp: int):
     """Record token metadata to a registry CSV (append-only; de-dup later in batch jobs)."""
@@ -412,9 +1187,10 @@ def upsert_token_registry(token_contract: str, symbol: Optional[str], decimals:
 def enqueue_price_task(token_contract: str, date_str: str):
     """Queue a (token, date) pair for later price backfill, deduped for the run."""
     key = (token_contract.lower(), date_str)
-    if key in PRICE_TASKS_SET:
-        return
-    PRICE_TASKS_SET.add(key)
+    with PRICE_TASKS_LOCK:
+        if key in PRICE_TASKS_SET:
+            return
+        PRICE_TASKS_SET.add(key)
     try:
         rec = [{ 'tokenContract': token_contract, 'date': date_str }]
         tasks_csv = os.path.join(OUTPUT_DIR, 'price_tasks.csv')
@@ -422,86 +1198,225 @@ def enqueue_price_task(token_contract: str, date_str: str):
     except Exception as e:
         print(f"⚠️ Failed to enqueue price task for {token_contract} @ {date_str}: {e}")
 
-def _serialize_value(v):
-    from decimal import Decimal as _D
-    if isinstance(v, _D):
-        return str(v)
-    return v
-
-def write_csv(file_path: str, records: list, columns: list, mode='a'):
-    """Append records to a CSV file with provided columns; create header if new."""
+def get_csv_writer(file_path: str, columns: list):
+    """Return a csv.writer on a run-long append handle for file_path, writing the header if the file is new."""
+    entry = _CSV_WRITERS.get(file_path)
+    if entry is None:
+        import csv
+        is_new = not os.path.exists(file_path)
+        f = open(file_path, 'a', newline='', buffering=1 << 20)
+        writer = csv.writer(f)
+        if is_new:
+            writer.writerow(columns)
+        entry = _CSV_WRITERS[file_path] = (f, writer)
+    return entry[1]
+
+def _flush_csv_buffer(file_path: str):
+    """writerows() the buffered rows for one path; caller holds CSV_WRITE_LOCK."""
+    buf = _CSV_BUFFERS.get(file_path)
+    if buf:
+        _CSV_WRITERS[file_path][1].writerows(buf)
+        buf.clear()
+
+def flush_csv_buffers():
+    """Hand every buffered row to its writer (block boundaries and shutdown)."""
+    with CSV_WRITE_LOCK:
+        for file_path in _CSV_BUFFERS:
+            _flush_csv_buffer(file_path)
+
+def close_csv_writers():
+    """Flush and close every run-long CSV handle (registered with atexit)."""
+    with CSV_WRITE_LOCK:
+        for file_path in _CSV_BUFFERS:
+            _flush_csv_buffer(file_path)
+        _CSV_BUFFERS.clear()
+        for f, _ in _CSV_WRITERS.values():
+            f.close()
+        _CSV_WRITERS.clear()
+
+atexit.register(close_csv_writers)
+
+def _record_rows(records: list, columns: list) -> list:
+    """Records as row tuples in `columns` order: namedtuple records already are, dicts are projected."""
+    if isinstance(records[0], tuple):
+        return records
+    return [tuple(r.get(c) for c in columns) for r in records]
+
+def write_csv(file_path: str, records: list, columns: list, mode='a', keep_open=True):
+    """Append records (dicts, or tuples already in `columns` order) to a CSV file; create header if new.
+
+    Appends are buffered and written in chunks through a handle kept open for the
+    whole run; pass keep_open=False for files written once (per-block outputs)
+    so handles do not accumulate.
+    """
     if not records:
         return
     import csv
-    is_new = not os.path.exists(file_path)
-    with open(file_path, mode, newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=columns)
-        if is_new:
-            writer.writeheader()
-        for r in records:
-            row = {c: _serialize_value(r.get(c)) for c in columns}
-            writer.writerow(row)
+    # csv.writer str()s every value itself (Decimal / TokenAmount included); only USD floats need their own formatting
+    rows = _usd_as_text(_record_rows(records, columns), columns)
+    with CSV_WRITE_LOCK:
+        if mode == 'a' and keep_open:
+            get_csv_writer(file_path, columns)  # header is written on first use
+            buf = _CSV_BUFFERS.setdefault(file_path, [])
+            buf.extend(rows)
+            if len(buf) >= _CSV_MAX_BUFFER:
+                _flush_csv_buffer(file_path)
+            return
+        is_new = not os.path.exists(file_path)
+        with open(file_path, mode, newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(columns)
+            writer.writerows(rows)
+
+def parquet_partition_path(table: str, block_number: int) -> str:
+    """Hive-style path output/parquet/<table>/block_bucket=<n // 10000>/<table>_<n>.parquet for range scans."""
+    bucket = block_number // PARQUET_BLOCKS_PER_PARTITION
+    partition_dir = os.path.join(OUTPUT_DIR, 'parquet', table, f'block_bucket={bucket}')
+    os.makedirs(partition_dir, exist_ok=True)
+    return os.path.join(partition_dir, f'{table}_{block_number}.parquet')
+
+def write_parquet(file_path: str, records: list, columns: list):
+    """Write records to a zstd-compressed Parquet file with a fixed per-column schema."""
+    if not records:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrow_types = {
+        'int64': pa.int64(),
+        'int32': pa.int32(),
+        'float64': pa.float64(),
+        'dictionary': pa.dictionary(pa.int32(), pa.string()),
+    }
+    schema = pa.schema([(c, arrow_types.get(PARQUET_COLUMN_TYPES.get(c), pa.string())) for c in columns])
+    data = {c: list(values) for c, values in zip(columns, zip(*_record_rows(records, columns)))}
+    for c in columns:
+        if PARQUET_COLUMN_TYPES.get(c) is None:
+            data[c] = [None if v is None else str(v) for v in data[c]]
+    pq.write_table(pa.Table.from_pydict(data, schema=schema), file_path, compression='zstd')
 
 def get_pool_tokens(pool_address: str) -> Optional[Dict[str, str]]:
     """Fetch and cache token0/token1 addresses for a given pool (V2/V3/Velodrome-like)."""
     if pool_address in POOL_TOKEN_CACHE:
         return POOL_TOKEN_CACHE[pool_address]
+    get_pool_tokens_batch([pool_address])
+    return POOL_TOKEN_CACHE.get(pool_address)
+
+def _pool_multicall(pools: List[str], selectors: List[str]) -> Dict[str, List[Tuple[bool, bytes]]]:
+    """Run each selector against every pool through Multicall3 (one POST); (success, returnData) per pool and selector."""
+    chunks = [pools[i:i + POOL_BATCH_SIZE] for i in range(0, len(pools), POOL_BATCH_SIZE)]
+    requests_batch = [
+        multicall_request(req_id, [(pool, selector) for pool in chunk for selector in selectors])
+        for req_id, chunk in enumerate(chunks, start=1)
+    ]
     try:
-        # Try standard Uniswap V2/V3 style token0/token1
-        abi_token01 = json.loads('[{"inputs":[],"name":"token0","outputs":[{"internalType":"address","name":"","type":"address"}],"stateMutability":"view","type":"function"},{"inputs":[],"name":"token1","outputs":[{"internalType":"address","name":"","type":"address"}],"stateMutability":"view","type":"function"}]')
-        contract = w3.eth.contract(address=pool_address, abi=abi_token01)
+        responses = post_rpc_batch(requests_batch)
+    except Exception as e:
+        print(f"⚠️ Pool token multicall failed for {len(pools)} pools: {e}")
+        responses = {}
+    out: Dict[str, List[Tuple[bool, bytes]]] = {}
+    for req_id, chunk in enumerate(chunks, start=1):
         try:
-            t0 = contract.functions.token0().call()
-            t1 = contract.functions.token1().call()
-            res = { 'token0': Web3.to_checksum_address(t0), 'token1': Web3.to_checksum_address(t1) }
+            results = decode_multicall_response(responses.get(req_id))
         except Exception:
-            # Fallback: Solidly/Aerodrome-style tokens() returning (token0, token1)
-            abi_tokens = json.loads('[{"inputs":[],"name":"tokens","outputs":[{"internalType":"address","name":"token0","type":"address"},{"internalType":"address","name":"token1","type":"address"}],"stateMutability":"view","type":"function"}]')
-            contract2 = w3.eth.contract(address=pool_address, abi=abi_tokens)
-            t0, t1 = contract2.functions.tokens().call()
-            res = { 'token0': Web3.to_checksum_address(t0), 'token1': Web3.to_checksum_address(t1) }
-        POOL_TOKEN_CACHE[pool_address] = res
-        return res
-    except Exception:
-        POOL_TOKEN_CACHE[pool_address] = None
-        return None
-
-def parse_and_enrich_swaps(block_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+            results = []
+        for i, pool in enumerate(chunk):
+            base = i * len(selectors)
+            out[pool] = [results[k] if k < len(results) else (False, b'') for k in range(base, base + len(selectors))]
+    return out
+
+def get_pool_tokens_batch(pools: List[str]) -> None:
+    """Resolve token0/token1 for all uncached pools via Multicall3, with one tokens() round for pools that lack them."""
+    pending = [p for p in dict.fromkeys(pools) if p not in POOL_TOKEN_CACHE]
+    if not pending:
+        return
+    # Standard Uniswap V2/V3 style token0()/token1()
+    retry = []
+    for pool, ((ok0, data0), (ok1, data1)) in _pool_multicall(pending, [POOL_TOKEN0_SELECTOR, POOL_TOKEN1_SELECTOR]).items():
+        if ok0 and ok1 and len(data0) >= 32 and len(data1) >= 32:
+            POOL_TOKEN_CACHE[pool] = {'token0': _checksum(data0[12:32].hex()), 'token1': _checksum(data1[12:32].hex())}
+        else:
+            retry.append(pool)
+    if not retry:
+        return
+    # Fallback: Solidly/Aerodrome-style tokens() returning (token0, token1)
+    for pool, ((ok, data),) in _pool_multicall(retry, [POOL_TOKENS_SELECTOR]).items():
+        if ok and len(data) >= 64:
+            POOL_TOKEN_CACHE[pool] = {'token0': _checksum(data[12:32].hex()), 'token1': _checksum(data[44:64].hex())}
+        else:
+            POOL_TOKEN_CACHE[pool] = None
+            UNRESOLVED_POOLS.add(pool.lower())
+
+def decode_v2_swap_amounts(data_hex: str) -> Tuple[bool, int, int]:
+    """(zero_for_one, amount in, amount out) from V2/Solidly Swap data: amount0In, amount1In, amount0Out, amount1Out."""
+    data = bytes.fromhex(data_hex[2:258])  # one hex decode for the four uint256 words
+    from_bytes = int.from_bytes
+    amount0_in = from_bytes(data[0:32], 'big')
+    if amount0_in > 0:
+        return True, amount0_in, from_bytes(data[96:128], 'big')
+    return False, from_bytes(data[32:64], 'big'), from_bytes(data[64:96], 'big')
+
+def decode_v3_swap_amounts(data_hex: str) -> Tuple[bool, int, int]:
+    """(zero_for_one, amount in, amount out) from V3 Swap data; only amount0/amount1 (int256, positive = into the pool) are needed."""
+    data = bytes.fromhex(data_hex[2:130])  # sqrtPriceX96, liquidity and tick are never read
+    amount0 = int.from_bytes(data[0:32], 'big', signed=True)
+    amount1 = int.from_bytes(data[32:64], 'big', signed=True)
+    if amount0 > 0:
+        return True, amount0, -amount1
+    return False, amount1, -amount0
+
+# log bucket -> (log label, minimum data bytes, amount decoder); add an entry here (and in LOG_TOPIC_BUCKETS) for new swap events
+SWAP_DECODERS = {
+    'v2': ('V2', 32 * 4, decode_v2_swap_amounts),
+    'v3': ('V3', 32 * 5, decode_v3_swap_amounts),
+}
+
+def parse_and_enrich_swaps(block_data: Dict[str, Any]) -> List[SwapRecord]:
     """Parse common DEX swap events (Uniswap V2/Solidly-style and Uniswap V3) and enrich with metadata and USD values."""
-    receipts = block_data.get('receipts', [])
+    buckets = bucket_logs(block_data)
     block_number = int(block_data.get('blockNumber'))
-    # estimate date for pricing from block timestamp via first tx (fallback to today)
-    date_str = datetime.now(timezone.utc).strftime('%d-%m-%Y')
-    swaps: List[Dict[str, Any]] = []
-    try:
-        # Best-effort fetch of block timestamp via eth_getBlockByNumber (fast, single call)
-        b = w3.eth.get_block(block_number)
-        block_ts = int(b.timestamp)
-        date_str = datetime.fromtimestamp(block_ts, timezone.utc).strftime('%d-%m-%Y')
-    except Exception:
-        pass
-
-    scanned_logs = 0
-    v2_matches = 0
-    v3_matches = 0
-    v2_shortdata = 0
-    v3_shortdata = 0
+    # Block timestamp comes from the header fetched in the same batch as the logs
+    block_ts = int(block_data.get('timestamp') or time.time())
+    date_str = datetime.fromtimestamp(block_ts, timezone.utc).strftime('%d-%m-%Y')
+    swaps: List[SwapRecord] = []
+
+    # Pre-pass: resolve every swapping pool, then fetch metadata for all their tokens in one multicall
+    block_pools = []
+    for log in [log for kind in SWAP_DECODERS for log in buckets[kind]]:
+        if log.get('address'):
+            try:
+                block_pools.append(_checksum(log['address']))
+            except Exception:
+                continue
+    block_pools = list(dict.fromkeys(block_pools))
+    get_pool_tokens_batch(block_pools)
+    pool_tokens = [POOL_TOKEN_CACHE.get(pool) for pool in block_pools]
+    swap_tokens = list(dict.fromkeys(t for tokens in pool_tokens if tokens for t in (tokens['token0'], tokens['token1'])))
+    get_token_metadata_batch(swap_tokens)
+
+    scanned_logs = block_data.get('scannedLogs', 0)
+    matches = dict.fromkeys(SWAP_DECODERS, 0)
+    shortdata = dict.fromkeys(SWAP_DECODERS, 0)
     token_resolution_failures = 0
     metadata_failures = 0
-    price_failures = 0
     unexpected_errors = 0
-    for receipt in receipts:
-        tx_hash = receipt.get('transactionHash')
-        logs = receipt.get('logs', [])
-        for log in logs:
-            scanned_logs += 1
+    # Each bucket holds only its own swap kind; its decoder comes from one table lookup, not per-log topic branches
+    for kind, (label, min_data_len, decode_amounts) in SWAP_DECODERS.items():
+        for log in buckets[kind]:
+            tx_hash = log.get('transactionHash')
+            if tx_hash is not None:
+                tx_hash = sys.intern(tx_hash)  # swaps and transfers of one tx share a single hash string
             try:
-                topic0 = log.get('topics', [None])[0]
                 addr = log.get('address')
                 if not addr:
                     continue
+                if addr.lower() in UNRESOLVED_POOLS:
+                    # Pool whose tokens could not be resolved before: skip the decode, count it as before
+                    matches[kind] += 1
+                    token_resolution_failures += 1
+                    continue
                 try:
-                    pool_addr = Web3.to_checksum_address(addr)
+                    pool_addr = _checksum(addr)
                 except Exception:
                     continue
                 log_index_hex = log.get('logIndex') or log.get('log_index')
@@ -509,180 +1424,80 @@ def parse_and_enrich_swaps(block_data: Dict[str, Any]) -> List[Dict[str, Any]]:
                     continue
                 log_index = int(log_index_hex, 16) if isinstance(log_index_hex, str) and log_index_hex.startswith('0x') else int(log_index_hex)
 
-                # Uniswap V2 / Velodrome / Solidly style
-                if topic0 == UNIV2_SWAP_TOPIC or topic0 == UNIV2_SWAP_TOPIC_ALT:
-                    v2_matches += 1
-                    # data encodes: amount0In, amount1In, amount0Out, amount1Out (uint256 x4)
-                    data_hex = log.get('data', '0x')
-                    raw = bytes.fromhex(data_hex[2:]) if data_hex.startswith('0x') else bytes()
-                    if len(raw) >= 32*4:
-                        amounts = w3.codec.decode(['uint256','uint256','uint256','uint256'], raw)
-                        amount0_in, amount1_in, amount0_out, amount1_out = [Decimal(int(x)) for x in amounts]
-                    else:
-                        v2_shortdata += 1
-                        print(f"    V2 Swap data too short (len={len(raw)} bytes) for pool {pool_addr}; skipping")
-                        continue
-                    tokens = get_pool_tokens(pool_addr)
-                    if not tokens:
-                        token_resolution_failures += 1
-                        print(f"    V2 swap match but tokens unavailable for pool {pool_addr}; skipping")
-                        continue
-                    token0 = tokens['token0']; token1 = tokens['token1']
-                    # decide direction
-                    if amount0_in > 0:
-                        token_in, token_out = token0, token1
-                        amt_in, amt_out = amount0_in, amount1_out
-                    else:
-                        token_in, token_out = token1, token0
-                        amt_in, amt_out = amount1_in, amount0_out
-
-                    # metadata and normalization (resilient)
-                    sym_in = None; sym_out = None
-                    dec_in = 18; dec_out = 18
-                    try:
-                        meta_in = get_token_metadata(token_in) or {}
-                        meta_out = get_token_metadata(token_out) or {}
-                        dec_in = int(meta_in.get('decimals', 18))
-                        dec_out = int(meta_out.get('decimals', 18))
-                        sym_in = meta_in.get('symbol')
-                        sym_out = meta_out.get('symbol')
-                    except Exception as e:
-                        metadata_failures += 1
-                        print(f"    V2 metadata fetch failed for pool {pool_addr}: {e}")
-                    norm_in = amt_in / (Decimal(10) ** dec_in) if amt_in is not None else None
-                    norm_out = amt_out / (Decimal(10) ** dec_out) if amt_out is not None else None
-
-                    # Token registry upsert for both sides
-                    ts_val = int(b.timestamp) if 'b' in locals() else int(time.time())
-                    try:
-                        upsert_token_registry(token_in, sym_in, dec_in, block_number, ts_val)
-                        upsert_token_registry(token_out, sym_out, dec_out, block_number, ts_val)
-                    except Exception:
-                        pass
+                matches[kind] += 1
+                data_hex = log.get('data', '0x')
+                data_len = (len(data_hex) - 2) // 2 if data_hex.startswith('0x') else 0  # bytes
+                if data_len < min_data_len:
+                    shortdata[kind] += 1
+                    if VERBOSE:
+                        print(f"    {label} Swap data too short (len={data_len} bytes) for pool {pool_addr}; skipping")
+                    continue
+                zero_for_one, amt_in, amt_out = decode_amounts(data_hex)
+                tokens = get_pool_tokens(pool_addr)
+                if not tokens:
+                    token_resolution_failures += 1
+                    if VERBOSE:
+                        print(f"    {label} swap match but tokens unavailable for pool {pool_addr}; skipping")
+                    continue
+                token0 = tokens['token0']; token1 = tokens['token1']
+                token_in, token_out = (token0, token1) if zero_for_one else (token1, token0)
 
-                    # USD valuation (resilient) or deferred pricing
-                    usd_in = None; usd_out = None
-                    if DEFER_PRICES:
-                        try:
-                            enqueue_price_task(token_in, date_str)
-                            enqueue_price_task(token_out, date_str)
-                        except Exception:
-                            pass
-                    else:
-                        try:
-                            cg_in = ADDRESS_TO_ID_MAP.get(token_in)
-                            cg_out = ADDRESS_TO_ID_MAP.get(token_out)
-                            price_in = get_historical_price(cg_in, date_str)
-                            price_out = get_historical_price(cg_out, date_str)
-                            usd_in = (norm_in * Decimal(str(price_in))) if (norm_in is not None and price_in is not None) else None
-                            usd_out = (norm_out * Decimal(str(price_out))) if (norm_out is not None and price_out is not None) else None
-                        except Exception as e:
-                            price_failures += 1
-                            print(f"    V2 pricing fetch failed for pool {pool_addr}: {e}")
-
-                    swaps.append({
-                        'transactionHash': tx_hash,
-                        'logIndex': log_index,
-                        'blockNumber': block_number,
-                        'timestamp': int(b.timestamp) if 'b' in locals() else int(time.time()),
-                        'chain': CHAIN,
-                        'poolContract': pool_addr,
-                        'tokenInContract': token_in,
-                        'tokenInSymbol': sym_in,
-                        'amountIn': norm_in,
-                        'usdValueIn': usd_in,
-                        'tokenOutContract': token_out,
-                        'tokenOutSymbol': sym_out,
-                        'amountOut': norm_out,
-                        'usdValueOut': usd_out,
-                    })
-
-                # Uniswap V3 style
-                elif topic0 == UNIV3_SWAP_TOPIC:
-                    v3_matches += 1
-                    data_hex = log.get('data', '0x')
-                    raw = bytes.fromhex(data_hex[2:]) if data_hex.startswith('0x') else bytes()
-                    if len(raw) >= 32*5:  # amounts and other fields
-                        # Decode full tuple, then use first two values (amount0, amount1)
-                        decoded = w3.codec.decode(['int256','int256','uint160','uint128','int24'], raw)
-                        amount0 = Decimal(int(decoded[0]))
-                        amount1 = Decimal(int(decoded[1]))
-                    else:
-                        v3_shortdata += 1
-                        print(f"    V3 Swap data too short (len={len(raw)} bytes) for pool {pool_addr}; skipping")
-                        continue
-                    tokens = get_pool_tokens(pool_addr)
-                    if not tokens:
-                        token_resolution_failures += 1
-                        print(f"    V3 swap match but tokens unavailable for pool {pool_addr}; skipping")
-                        continue
-                    token0 = tokens['token0']; token1 = tokens['token1']
-                    # In V3, positive amount means to the pool (in), negative means out from pool
-                    if amount0 > 0:
-                        token_in, token_out = token0, token1
-                        amt_in, amt_out = amount0, -amount1
-                    else:
-                        token_in, token_out = token1, token0
-                        amt_in, amt_out = amount1, -amount0
-
-                    sym_in = None; sym_out = None
-                    dec_in = 18; dec_out = 18
-                    try:
-                        meta_in = get_token_metadata(token_in) or {}
-                        meta_out = get_token_metadata(token_out) or {}
-                        dec_in = int(meta_in.get('decimals', 18))
-                        dec_out = int(meta_out.get('decimals', 18))
-                        sym_in = meta_in.get('symbol')
-                        sym_out = meta_out.get('symbol')
-                    except Exception as e:
+                # metadata and normalization (resilient)
+                sym_in = None; sym_out = None
+                dec_in = 18; dec_out = 18
+                try:
+                    meta_in = get_token_metadata(token_in)
+                    meta_out = get_token_metadata(token_out)
+                    if token_in not in TOKEN_METADATA_CACHE or token_out not in TOKEN_METADATA_CACHE:
+                        # Metadata multicall is failing (METADATA_UNAVAILABLE): skip rather than write amounts with guessed decimals
                         metadata_failures += 1
-                        print(f"    V3 metadata fetch failed for pool {pool_addr}: {e}")
-                    norm_in = amt_in / (Decimal(10) ** dec_in) if amt_in is not None else None
-                    norm_out = amt_out / (Decimal(10) ** dec_out) if amt_out is not None else None
+                        if VERBOSE:
+                            print(f"    {label} metadata unavailable for pool {pool_addr}; skipping")
+                        continue
+                    meta_in = meta_in or {}
+                    meta_out = meta_out or {}
+                    dec_in = int(meta_in.get('decimals', 18))
+                    dec_out = int(meta_out.get('decimals', 18))
+                    sym_in = meta_in.get('symbol')
+                    sym_out = meta_out.get('symbol')
+                except Exception as e:
+                    metadata_failures += 1
+                    print(f"    {label} metadata fetch failed for pool {pool_addr}: {e}")
+                # Raw ints stay raw through parsing; the sinks render them (see TokenAmount)
+                norm_in = TokenAmount(amt_in, dec_in)
+                norm_out = TokenAmount(amt_out, dec_out)
 
-                    # Token registry upsert for both sides
-                    ts_val = int(b.timestamp) if 'b' in locals() else int(time.time())
+                # Token registry upsert for both sides
+                try:
+                    upsert_token_registry(token_in, sym_in, dec_in, block_number, block_ts)
+                    upsert_token_registry(token_out, sym_out, dec_out, block_number, block_ts)
+                except Exception:
+                    pass
+
+                # USD values are joined by apply_prices() after parsing, or deferred
+                if DEFER_PRICES:
                     try:
-                        upsert_token_registry(token_in, sym_in, dec_in, block_number, ts_val)
-                        upsert_token_registry(token_out, sym_out, dec_out, block_number, ts_val)
+                        enqueue_price_task(token_in, date_str)
+                        enqueue_price_task(token_out, date_str)
                     except Exception:
                         pass
 
-                    usd_in = None; usd_out = None
-                    if DEFER_PRICES:
-                        try:
-                            enqueue_price_task(token_in, date_str)
-                            enqueue_price_task(token_out, date_str)
-                        except Exception:
-                            pass
-                    else:
-                        try:
-                            cg_in = ADDRESS_TO_ID_MAP.get(token_in)
-                            cg_out = ADDRESS_TO_ID_MAP.get(token_out)
-                            price_in = get_historical_price(cg_in, date_str)
-                            price_out = get_historical_price(cg_out, date_str)
-                            usd_in = (norm_in * Decimal(str(price_in))) if (norm_in is not None and price_in is not None) else None
-                            usd_out = (norm_out * Decimal(str(price_out))) if (norm_out is not None and price_out is not None) else None
-                        except Exception as e:
-                            price_failures += 1
-                            print(f"    V3 pricing fetch failed for pool {pool_addr}: {e}")
-
-                    swaps.append({
-                        'transactionHash': tx_hash,
-                        'logIndex': log_index,
-                        'blockNumber': block_number,
-                        'timestamp': int(b.timestamp) if 'b' in locals() else int(time.time()),
-                        'chain': CHAIN,
-                        'poolContract': pool_addr,
-                        'tokenInContract': token_in,
-                        'tokenInSymbol': sym_in,
-                        'amountIn': norm_in,
-                        'usdValueIn': usd_in,
-                        'tokenOutContract': token_out,
-                        'tokenOutSymbol': sym_out,
-                        'amountOut': norm_out,
-                        'usdValueOut': usd_out,
-                    })
+                swaps.append(SwapRecord(
+                    blockNumber=block_number,
+                    timestamp=block_ts,
+                    chain=CHAIN,
+                    transactionHash=tx_hash,
+                    logIndex=log_index,
+                    poolContract=pool_addr,
+                    tokenInContract=token_in,
+                    tokenInSymbol=sym_in,
+                    amountIn=norm_in,
+                    usdValueIn=None,
+                    tokenOutContract=token_out,
+                    tokenOutSymbol=sym_out,
+                    amountOut=norm_out,
+                    usdValueOut=None,
+                ))
 
             except Exception as e:
                 unexpected_errors += 1
@@ -692,17 +1507,62 @@ def parse_and_enrich_swaps(block_data: Dict[str, Any]) -> List[Dict[str, Any]]:
                     topic0_dbg = None
                 print(f"    Unexpected error decoding swap log: pool={addr}, topic0={topic0_dbg}, err={e}")
                 continue
-
-    print(
-        f"Swaps scan summary for block {block_number}: "
-        f"scanned_logs={scanned_logs}, v2_topic_matches={v2_matches}, v3_topic_matches={v3_matches}, "
-        f"decoded_swaps={len(swaps)}, v2_shortdata={v2_shortdata}, v3_shortdata={v3_shortdata}, "
-        f"token_resolution_failures={token_resolution_failures}, metadata_failures={metadata_failures}, price_failures={price_failures}, unexpected_errors={unexpected_errors}"
-    )
+    swaps.sort(key=lambda s: s.logIndex)  # back to log order across the two buckets
+
+    if VERBOSE or unexpected_errors:
+        print(
+            f"Swaps scan summary for block {block_number}: "
+            f"scanned_logs={scanned_logs}, v2_topic_matches={matches['v2']}, v3_topic_matches={matches['v3']}, "
+            f"decoded_swaps={len(swaps)}, v2_shortdata={shortdata['v2']}, v3_shortdata={shortdata['v3']}, "
+            f"token_resolution_failures={token_resolution_failures}, metadata_failures={metadata_failures}, unexpected_errors={unexpected_errors}"
+        )
     return swaps
 
 # --- MAIN EXECUTION ---
 
+def apply_prices(parsed_blocks: List[Tuple[int, List[TransferRecord], List[SwapRecord]]]) -> None:
+    """Fill USD values for a parsed batch: one bulk price prefetch for all its (coingecko_id, date) pairs, then cache lookups."""
+    dates: Dict[int, str] = {}
+
+    def price_key(token: str, ts: int) -> Tuple[Optional[str], str]:
+        # Transfers and swaps are both dated by their UTC day, the day CoinGecko's daily price belongs to
+        if ts not in dates:
+            dates[ts] = datetime.fromtimestamp(ts, timezone.utc).strftime('%d-%m-%Y')
+        return ADDRESS_TO_ID_MAP.get(token.lower()), dates[ts]
+
+    jobs = []  # (record list, index, usd field, amount, (coingecko_id, date))
+    for _, transfers, swaps in parsed_blocks:
+        for i, t in enumerate(transfers):
+            jobs.append((transfers, i, 'usdValue', t.value, price_key(t.tokenContract, t.timestamp)))
+        for i, sw in enumerate(swaps):
+            jobs.append((swaps, i, 'usdValueIn', sw.amountIn, price_key(sw.tokenInContract, sw.timestamp)))
+            jobs.append((swaps, i, 'usdValueOut', sw.amountOut, price_key(sw.tokenOutContract, sw.timestamp)))
+    if not jobs:
+        return
+    prefetch_historical_prices(pair for *_, pair in jobs)
+    for records, i, field, amount, pair in jobs:
+        price = get_historical_price(*pair)
+        if amount is not None and price is not None:
+            # Float math is plenty for USD (CoinGecko prices are floats already); rounded to the DB's NUMERIC(38, 8) scale
+            records[i] = records[i]._replace(**{field: round(amount.to_float() * price, 8)})
+
+def parse_blocks(blocks: List[Dict[str, Any]]) -> List[Tuple[int, List[TransferRecord], List[SwapRecord]]]:
+    """Parse one fetched batch of blocks on a worker thread; returns (block, transfers, swaps) without touching the DB."""
+    parsed = []
+    for block_data in blocks:
+        # The header bloom rules out blocks without Transfer / Swap logs before bucketing any log
+        logs_bloom = block_data.get('logsBloom')
+        enriched_transfers = parse_and_enrich_transfers(block_data) if bloom_contains(logs_bloom, TRANSFER_EVENT_TOPIC) else []
+        if any(bloom_contains(logs_bloom, topic) for topic in SWAP_TOPICS_BYTES):
+            enriched_swaps = parse_and_enrich_swaps(block_data)
+        else:
+            enriched_swaps = []
+        parsed.append((block_data['blockNumber'], enriched_transfers, enriched_swaps))
+    if not DEFER_PRICES:
+        # Pricing runs once per batch after parsing, so the parse loops never wait on CoinGecko
+        apply_prices(parsed)
+    return parsed
+
 def get_last_processed_block(conn, chain: str) -> Optional[int]:
     try:
         with conn.cursor() as cur:
@@ -722,7 +1582,48 @@ def set_last_processed_block(conn, chain: str, block_number: int) -> None:
             """,
             (chain, int(block_number))
         )
-    conn.commit()
+
+def commit_blocks(conn, parsed_blocks: List[Tuple[int, List[TransferRecord], List[SwapRecord]]]) -> None:
+    """Insert a group of parsed blocks and advance pipeline_state in one transaction; rolled back and retried once on failure."""
+    if not parsed_blocks:
+        return
+    # One COPY per table for the whole group keeps DB round trips constant instead of per block
+    transfers = [t for _, enriched_transfers, _ in parsed_blocks for t in enriched_transfers]
+    swaps = [s for _, _, enriched_swaps in parsed_blocks for s in enriched_swaps]
+    for attempt in range(2):
+        try:
+            insert_transfers(conn, transfers)
+            insert_swaps(conn, swaps)
+            set_last_processed_block(conn, CHAIN, parsed_blocks[-1][0])
+            conn.commit()
+            return
+        except psycopg2.Error as e:
+            conn.rollback()
+            if attempt:
+                raise
+            print(f"⚠️ DB write for blocks {parsed_blocks[0][0]}-{parsed_blocks[-1][0]} failed, retrying: {e}")
+
+def db_writer_loop(conn, parsed_queue: "queue.Queue", errors: List[BaseException]) -> None:
+    """Insert stage: commit parsed blocks from parsed_queue in groups of DB_COMMIT_BLOCKS until a None sentinel arrives."""
+    uncommitted = []  # parsed blocks awaiting the next DB transaction
+    while True:
+        parsed_blocks = parsed_queue.get()
+        if parsed_blocks is None:
+            break
+        if errors:
+            continue  # keep draining so the producer never blocks on a dead writer
+        try:
+            uncommitted.extend(parsed_blocks)
+            if len(uncommitted) >= DB_COMMIT_BLOCKS:
+                commit_blocks(conn, uncommitted)
+                uncommitted.clear()
+        except Exception as e:
+            errors.append(e)
+    if not errors:
+        try:
+            commit_blocks(conn, uncommitted)
+        except Exception as e:
+            errors.append(e)
 
 
 if __name__ == "__main__":
@@ -748,21 +1649,65 @@ if __name__ == "__main__":
         if start_block > target_latest:
             print("No new blocks to process.")
         else:
-            for block_number in range(start_block, target_latest + 1):
-                block_data = get_block_with_receipts(block_number)
-                if not block_data:
-                    continue
-                enriched_transfers = parse_and_enrich_transfers(block_data)
-                if enriched_transfers:
-                    insert_transfers(db_conn, block_number, enriched_transfers)
-                enriched_swaps = parse_and_enrich_swaps(block_data)
-                if enriched_swaps:
-                    insert_swaps(db_conn, block_number, enriched_swaps)
-                else:
-                    print("No swaps decoded for this block.")
-                if USE_DB:
-                    set_last_processed_block(db_conn, CHAIN, block_number)
-                print(f"Processed block {block_number}.")
+            block_range = list(range(start_block, target_latest + 1))
+            batches = iter([block_range[i:i + BLOCK_BATCH_SIZE] for i in range(0, len(block_range), BLOCK_BATCH_SIZE)])
+            # RPC fetches run up to RPC_FETCH_AHEAD batches ahead on their own pool; parsing (which does
+            # its own metadata/price I/O) uses PIPELINE_WORKERS threads. Results are drained here in
+            # block order, so files and pipeline_state never move backwards on out-of-order completion
+            window = max(1, PIPELINE_WORKERS, RPC_FETCH_AHEAD)
+            # DB inserts run on their own thread behind a small bounded queue, so writing files and
+            # draining parse results never waits on Postgres (the queue applies backpressure)
+            db_queue: "queue.Queue" = queue.Queue(maxsize=max(1, DB_QUEUE_DEPTH))
+            db_errors: List[BaseException] = []
+            db_writer = None
+            if USE_DB:
+                db_writer = threading.Thread(target=db_writer_loop, args=(db_conn, db_queue, db_errors), name='db-writer')
+                db_writer.start()
+            try:
+                with ThreadPoolExecutor(max_workers=window) as fetch_pool, \
+                        ThreadPoolExecutor(max_workers=max(1, PIPELINE_WORKERS)) as executor:
+                    def submit_batch(batch):
+                        fetched = fetch_pool.submit(get_blocks_with_logs, batch)
+                        return executor.submit(lambda: parse_blocks(fetched.result()))
+
+                    in_flight = deque()
+                    run_started = time.time()
+                    done_blocks = done_transfers = done_swaps = 0
+                    for batch in batches:
+                        in_flight.append(submit_batch(batch))
+                        if len(in_flight) >= window:
+                            break
+                    while in_flight and not db_errors:
+                        parsed_blocks = in_flight.popleft().result()
+                        next_batch = next(batches, None)
+                        if next_batch is not None:
+                            in_flight.append(submit_batch(next_batch))
+                        for block_number, enriched_transfers, enriched_swaps in parsed_blocks:
+                            write_transfer_files(block_number, enriched_transfers)
+                            write_swap_files(block_number, enriched_swaps)
+                            flush_csv_buffers()
+                            if VERBOSE:
+                                print(f"Processed block {block_number}.")
+                            done_blocks += 1
+                            done_transfers += len(enriched_transfers)
+                            done_swaps += len(enriched_swaps)
+                            # One sampled progress line instead of several prints per block
+                            if done_blocks % PROGRESS_EVERY_BLOCKS == 0 or block_number == target_latest:
+                                elapsed = max(time.time() - run_started, 1e-9)
+                                print(
+                                    f"Processed through block {block_number}: {done_blocks}/{len(block_range)} blocks, "
+                                    f"{done_transfers} transfers, {done_swaps} swaps ({done_blocks / elapsed:.1f} blocks/s)"
+                                )
+                        if db_writer:
+                            db_queue.put(parsed_blocks)
+                    for future in in_flight:
+                        future.cancel()
+            finally:
+                if db_writer:
+                    db_queue.put(None)
+                    db_writer.join()
+            if db_errors:
+                raise db_errors[0]
 
         print("\nPipeline run complete.")
 
@@ -772,3 +1717,7 @@ if __name__ == "__main__":
         if USE_DB and db_conn:
             db_conn.close()
             print("\nDatabase connection closed.")
+        if PRICE_DB_CONN:
+            PRICE_DB_CONN.close()
+        if PRICE_SQLITE_CONN:
+            PRICE_SQLITE_CONN.close()
@@ -1,15 +1,30 @@
 import os
 import json
 import time
+import bisect
 import csv
+import functools
+import io
+import pickle
+import sqlite3
+import threading
 import requests
-from typing import Dict, Optional, Tuple, Set
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, List, Optional, Tuple, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from decimal import Decimal
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
 from web3 import Web3
 
+try:
+    import orjson  # optional: much faster parsing of the multi-MB coin list
+except ImportError:
+    orjson = None
+
 # Load environment
 load_dotenv()
 
@@ -17,8 +32,17 @@ load_dotenv()
 OUTPUT_DIR = os.getenv('OUTPUT_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'output'))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 COINGECKO_ASSET_PLATFORM_ID = 'base'
-REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '20'))
+REQUEST_TIMEOUT = (5, int(os.getenv('REQUEST_TIMEOUT', '20')))  # (connect, read) seconds
 COIN_LIST_CACHE_PATH = os.path.join(OUTPUT_DIR, 'coingecko_coin_list.json')
+COIN_MAP_CACHE_PATH = os.path.join(OUTPUT_DIR, 'coingecko_coin_list.map.pkl')  # derived address -> id map
+COIN_MAP_CACHE_VERSION = 1  # bump when the map's key format changes
+COINGECKO_CALLS_PER_MINUTE = int(os.getenv('COINGECKO_CALLS_PER_MINUTE', '45'))  # free tier allowance
+PRICE_FETCH_CONCURRENCY = int(os.getenv('PRICE_FETCH_CONCURRENCY', '4'))  # parallel CoinGecko requests
+# Same local cache file and table as the pipeline, so prices either one has looked up are never re-fetched
+PRICE_CACHE_SQLITE_PATH = os.getenv('PRICE_CACHE_SQLITE_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'price_cache.sqlite'))
+COINGECKO_429_RETRIES = 3  # times a rate-limited request is retried after waiting out Retry-After
+PRICE_RANGE_TOLERANCE = 3600  # a market_chart point must lie this close (seconds) to 00:00 UTC to stand in for /history
+PRICE_NEGATIVE_CACHE_TTL = 24 * 3600  # seconds before a "CoinGecko has no USD price" answer is asked again
 
 # DB config
 PIPELINE_SINK = os.getenv('PIPELINE_SINK', 'db').lower()  # db | csv | both
@@ -28,6 +52,10 @@ DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASS = os.getenv('DB_PASS')
+# TCP keepalives so the connection survives the long gaps between flushes while rate-limited fetches run
+DB_KEEPALIVE_KWARGS = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 3}
+INSERT_PAGE_SIZE = 1000  # rows per multi-row INSERT statement
+COPY_MIN_ROWS = 1000  # flushes at least this large go through COPY into a staging table instead
 
 # CSV schemas
 CSV_COLUMNS_PRICE_TASKS = ['tokenContract','date']
@@ -36,11 +64,58 @@ CSV_COLUMNS_PRICES = ['tokenContract','date','usd']
 ADDRESS_TO_ID_MAP: Dict[str, str] = {}
 
 
+def build_http_session() -> requests.Session:
+    """Keep-alive session with a shared connection pool and backoff on transient/rate-limit statuses."""
+    # 429 is left to coingecko_get, which pauses every thread for Retry-After rather than just the one that hit it
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(32, PRICE_FETCH_CONCURRENCY), max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = build_http_session()
+
+
+class RateLimiter:
+    """Thread-safe token bucket: bursts up to `calls` requests, refilled evenly over `period` seconds."""
+
+    def __init__(self, calls: int, period: float):
+        self.capacity = float(max(1, calls))
+        self.tokens = self.capacity
+        self.fill_rate = self.capacity / period
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Drain the bucket so no caller gets a token for `seconds`, then refill at the normal pace."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated) * self.fill_rate, 1 - seconds * self.fill_rate)
+            self.updated = now
+
+
+COINGECKO_RATE_LIMITER = RateLimiter(COINGECKO_CALLS_PER_MINUTE, 60)
+
+
 def get_db_connection():
     if not USE_DB:
         return None
     try:
-        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS, **DB_KEEPALIVE_KWARGS)
         print('✅ Connected to PostgreSQL for price inserts.')
         return conn
     except Exception as e:
@@ -48,107 +123,293 @@ def get_db_connection():
         return None
 
 
+def get_price_cache_connection():
+    """Open the local SQLite price cache shared with the pipeline; None if unavailable."""
+    try:
+        conn = sqlite3.connect(PRICE_CACHE_SQLITE_PATH)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS prices ('
+            'coingecko_id TEXT NOT NULL, date TEXT NOT NULL, price REAL, fetched_at INTEGER NOT NULL, '
+            'PRIMARY KEY (coingecko_id, date))'
+        )
+        conn.commit()
+        return conn
+    except sqlite3.Error as e:
+        print(f'⚠️ Local price cache unavailable: {e}')
+        return None
+
+
+def load_cached_prices(conn, pairs: Set[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[float]]:
+    """Cached answers for (coingecko_id, date) pairs; NULL rows (no CoinGecko price) count as hits until they expire."""
+    cached: Dict[Tuple[str, str], Optional[float]] = {}
+    if not conn or not pairs:
+        return cached
+    now = time.time()
+    try:
+        for coingecko_id, date_str in pairs:
+            row = conn.execute(
+                'SELECT price, fetched_at FROM prices WHERE coingecko_id = ? AND date = ?', (coingecko_id, date_str)
+            ).fetchone()
+            if row is None or (row[0] is None and now - row[1] > PRICE_NEGATIVE_CACHE_TTL):
+                continue
+            cached[(coingecko_id, date_str)] = row[0]
+    except sqlite3.Error as e:
+        print(f'⚠️ Could not read local price cache: {e}')
+    return cached
+
+
+def store_cached_prices(conn, rows: List[Tuple[str, str, Optional[float]]]):
+    """Record answered lookups (None for tokens without a USD price) in one transaction."""
+    if not conn or not rows:
+        return
+    now = int(time.time())
+    try:
+        conn.executemany(
+            'INSERT OR REPLACE INTO prices (coingecko_id, date, price, fetched_at) VALUES (?, ?, ?, ?)',
+            [(coingecko_id, date_str, price, now) for coingecko_id, date_str, price in rows]
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f'⚠️ Could not write local price cache: {e}')
+
+
+def json_loads(content: bytes):
+    """Parse a JSON response body, using orjson when available."""
+    return orjson.loads(content) if orjson else json.loads(content)
+
+
+def load_address_map_cache(source_mtime: float) -> Optional[Dict[str, str]]:
+    """Return the derived address map saved for this exact coin list cache (by mtime), if any."""
+    try:
+        with open(COIN_MAP_CACHE_PATH, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('source_mtime') == source_mtime and cached.get('version') == COIN_MAP_CACHE_VERSION:
+            return cached['map']
+    except Exception:
+        pass
+    return None
+
+
+def save_address_map_cache(source_mtime: float) -> None:
+    """Persist ADDRESS_TO_ID_MAP next to the coin list cache so later runs skip parsing the full list."""
+    try:
+        with open(COIN_MAP_CACHE_PATH, 'wb') as f:
+            pickle.dump({'source_mtime': source_mtime, 'version': COIN_MAP_CACHE_VERSION, 'map': ADDRESS_TO_ID_MAP}, f, protocol=5)
+    except Exception:
+        pass
+
+
 def build_address_to_id_map():
     global ADDRESS_TO_ID_MAP
     try:
         print('\nBuilding address-to-id map from CoinGecko (with local cache)...')
         token_list = None
+        list_mtime = None
         # Use local cache if fresh (<24h)
         if os.path.exists(COIN_LIST_CACHE_PATH):
             mtime = os.path.getmtime(COIN_LIST_CACHE_PATH)
             if time.time() - mtime < 24*3600:
-                with open(COIN_LIST_CACHE_PATH, 'r') as f:
-                    token_list = json.load(f)
+                cached_map = load_address_map_cache(mtime)
+                if cached_map is not None:
+                    ADDRESS_TO_ID_MAP.clear()
+                    ADDRESS_TO_ID_MAP.update(cached_map)
+                    print(f'✅ Map loaded from cache. {len(ADDRESS_TO_ID_MAP)} Base contracts mapped to CoinGecko IDs.')
+                    return
+                with open(COIN_LIST_CACHE_PATH, 'rb') as f:
+                    token_list = json_loads(f.read())
+                list_mtime = mtime
         if token_list is None:
             url = 'https://api.coingecko.com/api/v3/coins/list?include_platform=true'
-            resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-            resp.raise_for_status()
-            token_list = resp.json()
-            with open(COIN_LIST_CACHE_PATH, 'w') as f:
-                json.dump(token_list, f)
+            resp = coingecko_get(url)
+            token_list = json_loads(resp.content)
+            # the body as received; re-encoding it would only cost CPU
+            with open(COIN_LIST_CACHE_PATH, 'wb') as f:
+                f.write(resp.content)
+            list_mtime = os.path.getmtime(COIN_LIST_CACHE_PATH)
         ADDRESS_TO_ID_MAP.clear()
         for token in token_list:
             platforms = token.get('platforms') or {}
             base_addr = platforms.get(COINGECKO_ASSET_PLATFORM_ID)
             if base_addr:
-                try:
-                    checksum = Web3.to_checksum_address(base_addr)
-                    ADDRESS_TO_ID_MAP[checksum] = token['id']
-                except Exception:
-                    continue
+                # Keyed by lowercase hex, so neither building nor lookups need a keccak checksum
+                address = base_addr.strip().lower()
+                if len(address) == 42 and address.startswith('0x'):
+                    ADDRESS_TO_ID_MAP[address] = token['id']
+        save_address_map_cache(list_mtime)
         print(f'✅ Map built. {len(ADDRESS_TO_ID_MAP)} Base contracts mapped to CoinGecko IDs.')
     except Exception as e:
         print(f'⚠️ Could not build CoinGecko address map: {e}')
 
 
-def get_historical_price(coingecko_id: Optional[str], date_str: str) -> Optional[float]:
-    if not coingecko_id:
-        return None
+def retry_after_seconds(resp) -> float:
+    """Seconds a 429 response asks us to wait (Retry-After in seconds), else one minute for the window to reset."""
     try:
-        url = f'https://api.coingecko.com/api/v3/coins/{coingecko_id}/history?date={date_str}'
-        attempts = 0
-        while True:
-            attempts += 1
-            try:
-                resp = requests.get(url, timeout=REQUEST_TIMEOUT)
-                break
-            except requests.RequestException as re:
-                if attempts >= 3:
-                    raise re
-                time.sleep(1.5 * attempts)
-        resp.raise_for_status()
-        data = resp.json()
-        price = data.get('market_data', {}).get('current_price', {}).get('usd')
-        # rate limit: free tier ~ 50-100/min; keep ~1.2s spacing
-        time.sleep(1.2)
-        return price
-    except Exception as e:
-        print(f'   ⚠️ Price fetch failed for {coingecko_id} @ {date_str}: {e}')
-        return None
+        return max(0.0, float(resp.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return 60.0
+
+
+def coingecko_get(url: str):
+    """GET a CoinGecko URL within the shared rate limit; raises on request errors."""
+    for attempt in range(COINGECKO_429_RETRIES + 1):
+        # Token bucket instead of a fixed sleep: bursts through the per-minute allowance, then paces
+        COINGECKO_RATE_LIMITER.acquire()
+        resp = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+        if resp.status_code != 429 or attempt == COINGECKO_429_RETRIES:
+            break
+        wait = retry_after_seconds(resp)
+        print(f'   ⏳ CoinGecko rate limit hit, pausing requests for {wait:.0f}s')
+        COINGECKO_RATE_LIMITER.pause(wait)
+    resp.raise_for_status()
+    return resp
+
+
+def get_historical_price(coingecko_id: str, date_str: str) -> Optional[float]:
+    """USD price of a coin on a date (None when CoinGecko has none); raises on request errors."""
+    url = f'https://api.coingecko.com/api/v3/coins/{coingecko_id}/history?date={date_str}'
+    resp = coingecko_get(url)
+    data = json_loads(resp.content)
+    return data.get('market_data', {}).get('current_price', {}).get('usd')
+
+
+def get_price_range(coingecko_id: str, dates: List[str]) -> Dict[str, float]:
+    """USD prices for several dates of one coin from a single market_chart/range call; raises on request errors."""
+    # Task dates are UTC days (the pipeline dates transfers and swaps by UTC), as are CoinGecko's daily prices
+    midnights = {d: int(datetime.strptime(d, '%d-%m-%Y').replace(tzinfo=timezone.utc).timestamp()) for d in dates}
+    lo = min(midnights.values()) - PRICE_RANGE_TOLERANCE
+    hi = max(midnights.values()) + PRICE_RANGE_TOLERANCE
+    url = f'https://api.coingecko.com/api/v3/coins/{coingecko_id}/market_chart/range?vs_currency=usd&from={lo}&to={hi}'
+    resp = coingecko_get(url)
+    points = sorted((int(ts) // 1000, price) for ts, price in json_loads(resp.content).get('prices') or [] if price is not None)
+    stamps = [ts for ts, _ in points]
+    prices = {}
+    # /history reports the 00:00 UTC price, so take the point nearest each date's midnight
+    for date_str, midnight in midnights.items():
+        i = bisect.bisect_left(stamps, midnight)
+        nearest = min((points[j] for j in (i - 1, i) if 0 <= j < len(points)), key=lambda p: abs(p[0] - midnight), default=None)
+        if nearest and abs(nearest[0] - midnight) <= PRICE_RANGE_TOLERANCE:
+            prices[date_str] = nearest[1]
+    return prices
+
+
+def get_coin_prices(coingecko_id: str, dates: List[str]) -> Dict[str, Optional[float]]:
+    """USD prices of one coin for each date (None when CoinGecko has none); dates whose lookup failed are left out."""
+    prices: Dict[str, Optional[float]] = {}
+    if len(dates) > 1:
+        # One range request covers every date of the coin; only dates it has no point for cost a /history call each
+        try:
+            prices.update(get_price_range(coingecko_id, dates))
+        except Exception as e:
+            print(f'   ⚠️ Price range fetch failed for {coingecko_id}, falling back to daily lookups: {e}')
+    for date_str in dates:
+        if date_str in prices:
+            continue
+        try:
+            prices[date_str] = get_historical_price(coingecko_id, date_str)
+        except Exception as e:
+            print(f'   ⚠️ Price fetch failed for {coingecko_id} @ {date_str}: {e}')
+    return prices
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _checksum(address: str) -> str:
+    """EIP-55 checksum an address, one keccak per distinct address whatever its input casing."""
+    return Web3.to_checksum_address(address.lower())
 
 
 def read_price_tasks(path: str) -> Set[Tuple[str, str]]:
     tasks: Set[Tuple[str,str]] = set()
     if not os.path.exists(path):
         return tasks
-    with open(path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            token = row.get('tokenContract')
-            date = row.get('date')
+    with open(path, 'r', newline='') as f:
+        # Plain rows instead of a dict per row; the header only tells us which columns to take
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header or 'tokenContract' not in header or 'date' not in header:
+            return tasks
+        token_idx, date_idx = header.index('tokenContract'), header.index('date')
+        width = max(token_idx, date_idx) + 1
+        # The queue is append-only and repeats itself, so each distinct row is checksummed once
+        for token, date in {(row[token_idx], row[date_idx]) for row in reader if len(row) >= width}:
             if token and date:
                 try:
-                    token = Web3.to_checksum_address(token)
+                    token = _checksum(token)
                 except Exception:
                     continue
                 tasks.add((token, date))
     return tasks
 
 
-def write_csv(file_path: str, records: list, columns: list, mode='a'):
-    if not records:
-        return
-    is_new = not os.path.exists(file_path)
-    with open(file_path, mode, newline='') as f:
-        w = csv.DictWriter(f, fieldnames=columns)
-        if is_new:
-            w.writeheader()
-        for r in records:
-            w.writerow({c: r.get(c) for c in columns})
+def usd_numeric_text(usd: Optional[float]) -> Optional[str]:
+    """A price as plain NUMERIC text (never E-notation), the one form both the COPY and execute_values paths send."""
+    return format(Decimal(str(usd)), 'f') if usd is not None else None
 
 
-def upsert_prices_db(conn, rows: list):
-    if not conn or not rows:
-        return
-    query = (
-        'INSERT INTO prices (token_contract, date, usd) VALUES (%s, %s, %s) '
-        'ON CONFLICT (token_contract, date) DO UPDATE SET usd = EXCLUDED.usd'
-    )
-    data = [(r['tokenContract'], r['date'], Decimal(str(r['usd'])) if r.get('usd') is not None else None) for r in rows]
+def copy_prices_bulk(conn, data: List[tuple]):
+    """COPY rows into a temp staging copy of prices, then merge them over with one ON CONFLICT upsert."""
+    buffer = io.StringIO()
+    for token, date_str, usd in data:
+        # COPY text format: tab-separated, NULL as \N (addresses and dd-mm-YYYY dates need no escaping)
+        buffer.write('\t'.join((token, date_str, '\\N' if usd is None else usd)))
+        buffer.write('\n')
+    buffer.seek(0)
     with conn.cursor() as cur:
-        execute_batch(cur, query, data)
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS prices_stage (LIKE prices INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+        cur.copy_expert('COPY prices_stage (token_contract, date, usd) FROM STDIN', buffer)
+        cur.execute(
+            'INSERT INTO prices (token_contract, date, usd) SELECT token_contract, date, usd FROM prices_stage '
+            'ON CONFLICT (token_contract, date) DO UPDATE SET usd = EXCLUDED.usd'
+        )
+
+
+def upsert_prices_db(conn, data: List[tuple]):
+    """Upsert (token_contract, date, usd text from usd_numeric_text) rows, one per key, into the prices table."""
+    if not conn or not data:
+        return
+    if len(data) >= COPY_MIN_ROWS:
+        copy_prices_bulk(conn, data)
+    else:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                'INSERT INTO prices (token_contract, date, usd) VALUES %s '
+                'ON CONFLICT (token_contract, date) DO UPDATE SET usd = EXCLUDED.usd',
+                data,
+                page_size=INSERT_PAGE_SIZE
+            )
     conn.commit()
-    print(f'✅ Upserted {len(rows)} rows into prices table.')
+    print(f'✅ Upserted {len(data)} rows into prices table.')
+
+
+def flush_batch(csv_file, writer, conn, rows: List[tuple]):
+    """Write a batch of (token, date, usd) rows to prices.csv and the prices table in one pass over the rows.
+
+    Returns the connection to keep using: a new one if the server dropped the old one mid-run.
+    """
+    data = {}
+    for token, date_str, usd in rows:
+        writer.writerow((token, date_str, usd))
+        # One row per key: a single multi-row upsert may not touch the same row twice
+        data[(token, date_str)] = (token, date_str, usd_numeric_text(usd))
+    # the CSV is flushed at every batch boundary so an interrupt loses at most the batch in flight
+    csv_file.flush()
+    try:
+        upsert_prices_db(conn, list(data.values()))
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        # psycopg2 only notices a dropped connection when it is used: reconnect and retry the batch once
+        print(f'⚠️ DB connection lost, reconnecting to retry the batch: {e}')
+        try:
+            conn.close()
+        except Exception:
+            pass
+        conn = get_db_connection()
+        if conn is None:
+            # Stop loudly: carrying on would report success while every later batch misses the prices table
+            raise RuntimeError(f'DB reconnect failed; {len(data)} rows of this batch are in prices.csv but not the prices table') from e
+        upsert_prices_db(conn, list(data.values()))
+    return conn
 
 
 def main():
@@ -161,29 +422,72 @@ def main():
     print(f'Found {len(tasks)} unique (token,date) price tasks to process.')
 
     db_conn = get_db_connection()
+    cache_conn = get_price_cache_connection()
+    cached = load_cached_prices(cache_conn, {(ADDRESS_TO_ID_MAP[t.lower()], d) for t, d in tasks if t.lower() in ADDRESS_TO_ID_MAP})
+    print(f'{len(cached)} (coin,date) prices answered by the local cache.')
 
     processed = 0
     batch_rows = []
-    for token, date_str in sorted(tasks):
-        cg_id = ADDRESS_TO_ID_MAP.get(token)
-        usd = get_historical_price(cg_id, date_str) if cg_id else None
-        row = {'tokenContract': token, 'date': date_str, 'usd': usd}
-        batch_rows.append(row)
+    cache_rows = []
+    # prices.csv stays open for the whole run behind a 1 MB buffer
+    is_new = not os.path.exists(prices_csv)
+    prices_file = open(prices_csv, 'a', newline='', buffering=1 << 20)
+    prices_writer = csv.writer(prices_file)
+    if is_new:
+        prices_writer.writerow(CSV_COLUMNS_PRICES)
+
+    def flush():
+        nonlocal db_conn
+        # Fetched prices reach the local cache first, so a run stopped by a DB failure never re-fetches them
+        store_cached_prices(cache_conn, cache_rows)
+        db_conn = flush_batch(prices_file, prices_writer, db_conn, batch_rows)
+        batch_rows.clear()
+        cache_rows.clear()
+
+    def emit(token: str, date_str: str, usd: Optional[float], flush_every: int = 20):
+        nonlocal processed
+        batch_rows.append((token, date_str, usd))
         processed += 1
-        # write CSV progressively to avoid data loss on interrupts
-        if len(batch_rows) >= 20:
-            write_csv(prices_csv, batch_rows, CSV_COLUMNS_PRICES)
-            upsert_prices_db(db_conn, batch_rows)
-            batch_rows.clear()
+        if len(batch_rows) >= flush_every:
+            flush()
             print(f'...processed {processed}/{len(tasks)}')
 
+    # Tasks answered without a request go out first; the rest share one lookup per (coin, date)
+    pending: Dict[Tuple[str, str], List[str]] = {}
+    for token, date_str in sorted(tasks):
+        cg_id = ADDRESS_TO_ID_MAP.get(token.lower())
+        if cg_id and (cg_id, date_str) not in cached:
+            pending.setdefault((cg_id, date_str), []).append(token)
+        else:
+            # No request behind these rows, so nothing is lost by writing them as one large batch
+            emit(token, date_str, cached.get((cg_id, date_str)) if cg_id else None, flush_every=len(tasks))
     if batch_rows:
-        write_csv(prices_csv, batch_rows, CSV_COLUMNS_PRICES)
-        upsert_prices_db(db_conn, batch_rows)
-        batch_rows.clear()
+        flush()
+
+    # Coins run PRICE_FETCH_CONCURRENCY at a time; the shared token bucket keeps them within the rate limit
+    dates_by_coin: Dict[str, List[str]] = {}
+    for cg_id, date_str in pending:
+        dates_by_coin.setdefault(cg_id, []).append(date_str)
+    print(f'Fetching {len(pending)} prices for {len(dates_by_coin)} coins from CoinGecko ({PRICE_FETCH_CONCURRENCY} in parallel)...')
+    with ThreadPoolExecutor(max_workers=max(1, PRICE_FETCH_CONCURRENCY)) as pool:
+        futures = {pool.submit(get_coin_prices, cg_id, dates): cg_id for cg_id, dates in dates_by_coin.items()}
+        for future in as_completed(futures):
+            cg_id = futures[future]
+            prices = future.result()
+            for date_str in dates_by_coin[cg_id]:
+                if date_str in prices:
+                    cache_rows.append((cg_id, date_str, prices[date_str]))
+                for token in pending[(cg_id, date_str)]:
+                    emit(token, date_str, prices.get(date_str))
+
+    if batch_rows or cache_rows:
+        flush()
+    prices_file.close()
 
     if db_conn:
         db_conn.close()
+    if cache_conn:
+        cache_conn.close()
 
     print('🏁 Price worker complete.')
 